@@ -0,0 +1,308 @@
+"""
+Local stand-in for a Funkwhale server, serving a synthetic catalogue.
+
+Only the parts of the API used by the backend are implemented. Every
+request is counted per endpoint and can be delayed to simulate a remote
+server.
+"""
+import collections
+import json
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Catalogue:
+    """Synthetic library: ``albums`` albums of ``tracks_per_album`` tracks spread over ``artists`` artists."""
+
+    def __init__(self, artists=100, albums=1000, tracks_per_album=10, playlists=5, playlist_size=100):
+        self.artists_count = artists
+        self.albums_count = albums
+        self.tracks_per_album = tracks_per_album
+        self.tracks_count = albums * tracks_per_album
+        self.playlists = {
+            id: {
+                "name": f"Playlist {id}",
+                "tracks": [(id * 7919 + n * 104729) % self.tracks_count + 1 for n in range(playlist_size)],
+                "version": 0,
+            }
+            for id in range(1, playlists + 1)
+        }
+
+    def artist(self, id):
+        return {
+            "id": id,
+            "name": f"Artist {id:05d}",
+            "mbid": None,
+            "creation_date": date(id),
+            "cover": None,
+        }
+
+    def album_artist_id(self, id):
+        return (id - 1) % self.artists_count + 1
+
+    def album(self, id):
+        return {
+            "id": id,
+            "title": f"{chr(ord('A') + id % 26)}lbum {id:06d}",
+            "mbid": None,
+            "release_date": "2020-01-01",
+            "artist": self.artist(self.album_artist_id(id)),
+            "cover": {"urls": {"original": f"https://covers.example/{id}.jpg"}},
+            "creation_date": date(id),
+            "tracks_count": self.tracks_per_album,
+        }
+
+    def track(self, id):
+        album_id = (id - 1) // self.tracks_per_album + 1
+        return {
+            "id": id,
+            "title": f"Track {id:07d}",
+            "mbid": None,
+            "position": (id - 1) % self.tracks_per_album + 1,
+            "disc_number": 1,
+            "artist": self.artist(self.album_artist_id(album_id)),
+            "album": self.album(album_id),
+            "tags": ["Rock"],
+            "listen_url": f"/api/v1/listen/{id}/",
+            "uploads": [
+                {
+                    "uuid": f"{id}-flac",
+                    "duration": 240,
+                    "bitrate": 1000000,
+                    "extension": "flac",
+                    "mimetype": "audio/flac",
+                    "listen_url": f"/api/v1/listen/{id}/?upload={id}-flac",
+                },
+                {
+                    "uuid": f"{id}-mp3",
+                    "duration": 240,
+                    "bitrate": 192000,
+                    "extension": "mp3",
+                    "mimetype": "audio/mpeg",
+                    "listen_url": f"/api/v1/listen/{id}/?upload={id}-mp3",
+                },
+            ],
+            "creation_date": date(id),
+        }
+
+    def playlist(self, id):
+        playlist = self.playlists[id]
+        return {
+            "id": id,
+            "name": playlist["name"],
+            "tracks_count": len(playlist["tracks"]),
+            "modification_date": date(playlist["version"]),
+        }
+
+
+def date(n):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(1577836800 + n))
+
+
+class FakeFunkwhale:
+    def __init__(self, catalogue=None, latency=0.0, max_page_size=100):
+        self.catalogue = catalogue or Catalogue()
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.requests = collections.Counter()
+        self.bytes_sent = 0
+        self.token_version = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body are separate writes, don't let them wait for an ACK
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self, method):
+                parsed = urllib.parse.urlparse(self.path)
+                query = {k: v[-1] for k, v in urllib.parse.parse_qs(parsed.query).items()}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = urllib.parse.parse_qs(self.rfile.read(length).decode()) if length else {}
+                parts = [p for p in parsed.path.split("/") if p][2:]
+                with server._lock:
+                    server.requests[endpoint(parts)] += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                status, payload = server.route(method, parts, query, body)
+                if isinstance(payload, bytes):
+                    content, content_type = payload, "audio/mpeg"
+                else:
+                    content, content_type = json.dumps(payload).encode(), "application/json"
+                with server._lock:
+                    server.bytes_sent += len(content)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def do_PATCH(self):
+                self._handle("PATCH")
+
+            def do_DELETE(self):
+                self._handle("DELETE")
+
+        return Handler
+
+    def paginate(self, path, items, query):
+        page_size = min(int(query.get("page_size", 25)), self.max_page_size)
+        page = int(query.get("page", 1))
+        total = len(items)
+        results = [item() for item in items[(page - 1) * page_size:page * page_size]]
+        next_url = None
+        if page * page_size < total:
+            next_url = f"{self.url}/api/v1/{path}?" + urllib.parse.urlencode(
+                dict(query, page=page + 1)
+            )
+        return {"count": total, "next": next_url, "previous": None, "results": results}
+
+    def route(self, method, parts, query, body):
+        catalogue = self.catalogue
+        if not parts:
+            return 404, {}
+        resource = parts[0]
+        path = "/".join(parts) + "/"
+        if resource == "oauth" and method == "POST":
+            self.token_version += 1
+            return 200, {
+                "access_token": f"access-{self.token_version}",
+                "refresh_token": f"refresh-{self.token_version}",
+                "token_type": "Bearer",
+                "expires_in": 36000,
+                "scope": "read write",
+            }
+        if resource == "listen":
+            return 200, b"\0" * 1024
+        if resource == "search":
+            q = query.get("query", "").lower()
+            ids = range(1, 26)
+            return 200, {
+                "artists": [catalogue.artist(i) for i in ids if i <= catalogue.artists_count and q in catalogue.artist(i)["name"].lower()],
+                "albums": [catalogue.album(i) for i in ids if i <= catalogue.albums_count and q in catalogue.album(i)["title"].lower()],
+                "tracks": [catalogue.track(i) for i in ids if i <= catalogue.tracks_count and q in catalogue.track(i)["title"].lower()],
+            }
+        if resource == "artists":
+            if len(parts) > 1:
+                artist = catalogue.artist(int(parts[1]))
+                artist["albums"] = [
+                    catalogue.album(i)
+                    for i in range(int(parts[1]), catalogue.albums_count + 1, catalogue.artists_count)
+                ]
+                return 200, artist
+            ids = range(1, catalogue.artists_count + 1)
+            return 200, self.paginate(path, ordered(ids, query, catalogue.artist), query)
+        if resource == "albums":
+            if len(parts) > 1:
+                return 200, catalogue.album(int(parts[1]))
+            ids = range(1, catalogue.albums_count + 1)
+            if "artist" in query:
+                ids = range(int(query["artist"]), catalogue.albums_count + 1, catalogue.artists_count)
+            return 200, self.paginate(path, ordered(ids, query, catalogue.album), query)
+        if resource == "tracks":
+            if len(parts) > 1:
+                return 200, catalogue.track(int(parts[1]))
+            ids = range(1, catalogue.tracks_count + 1)
+            if "album" in query:
+                first = (int(query["album"]) - 1) * catalogue.tracks_per_album + 1
+                ids = range(first, first + catalogue.tracks_per_album)
+            elif "artist" in query:
+                ids = [
+                    t
+                    for album in range(int(query["artist"]), catalogue.albums_count + 1, catalogue.artists_count)
+                    for t in range((album - 1) * catalogue.tracks_per_album + 1, album * catalogue.tracks_per_album + 1)
+                ]
+            elif "favorites" in query:
+                ids = range(1, min(50, catalogue.tracks_count) + 1)
+            return 200, self.paginate(path, ordered(ids, query, catalogue.track), query)
+        if resource == "playlists":
+            return self.route_playlists(method, parts, query, body)
+        return 404, {}
+
+    def route_playlists(self, method, parts, query, body):
+        catalogue = self.catalogue
+        path = "/".join(parts) + "/"
+        if len(parts) == 1:
+            if method == "POST":
+                id = max(catalogue.playlists, default=0) + 1
+                catalogue.playlists[id] = {"name": body["name"][0], "tracks": [], "version": 0}
+                return 201, catalogue.playlist(id)
+            return 200, self.paginate(
+                path, [lambda id=id: catalogue.playlist(id) for id in sorted(catalogue.playlists)], query
+            )
+        id = int(parts[1])
+        playlist = catalogue.playlists.get(id)
+        if playlist is None:
+            return 404, {}
+        action = parts[2] if len(parts) > 2 else None
+        if action is None:
+            if method == "DELETE":
+                del catalogue.playlists[id]
+                return 204, {}
+            if method == "PATCH":
+                playlist["name"] = body["name"][0]
+                playlist["version"] += 1
+            return 200, catalogue.playlist(id)
+        if action == "tracks":
+            items = [
+                lambda index=index, track=track: {"index": index, "track": catalogue.track(track)}
+                for index, track in enumerate(playlist["tracks"])
+            ]
+            return 200, self.paginate(path, items, query)
+        playlist["version"] += 1
+        if action == "clear":
+            playlist["tracks"] = []
+        elif action == "add":
+            playlist["tracks"].extend(int(t) for t in body.get("tracks", []))
+        elif action == "remove":
+            playlist["tracks"].pop(int(body["index"][0]))
+        elif action == "move":
+            track = playlist["tracks"].pop(int(body["from"][0]))
+            playlist["tracks"].insert(int(body["to"][0]), track)
+        return 200, catalogue.playlist(id)
+
+
+def ordered(ids, query, build):
+    """Return lazy items for ``ids``, reversed for descending creation_date ordering."""
+    ids = list(ids)
+    if query.get("ordering") == "-creation_date":
+        ids.reverse()
+    return [lambda id=id: build(id) for id in ids]
+
+
+def endpoint(parts):
+    """Group request paths by logical endpoint: tracks/42 and tracks/43 are both ``tracks/{id}``."""
+    return "/".join("{id}" if part.isdigit() else part for part in parts) or "/"
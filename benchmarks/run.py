@@ -0,0 +1,208 @@
+"""
+Benchmark the Funkwhale backend against a local fake server.
+
+Run from the repository root, with mopidy and the backend dependencies
+installed::
+
+    python -m benchmarks.run --albums 5000 --latency 0.02
+    python -m benchmarks.run -o library_index=true -o http_engine=async
+
+It reports the time spent importing and starting the backend, then for
+each scenario the number of calls, the HTTP requests they issued, p50/p99
+latency and the peak Python memory allocated during the scenario.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fake_server import Catalogue, FakeFunkwhale
+
+
+# the fake server speaks plain HTTP
+os.environ.setdefault("OAUTHLIB_INSECURE_TRANSPORT", "1")
+
+
+def make_config(url, data_dir, overrides):
+    funkwhale = {
+        "enabled": True,
+        "url": url,
+        "client_id": "benchmark",
+        "client_secret": "benchmark",
+        "authorization_endpoint": "/authorize",
+        "token_endpoint": "/api/v1/oauth/token/",
+        "cache_duration": 600,
+        "verify_cert": True,
+    }
+    for override in overrides:
+        key, _, value = override.partition("=")
+        funkwhale[key] = parse_value(value)
+    return {
+        "core": {"data_dir": data_dir, "cache_dir": data_dir, "config_dir": data_dir},
+        "proxy": {},
+        "audio": {"output": "autoaudiosink"},
+        "funkwhale": funkwhale,
+    }
+
+
+def parse_value(value):
+    if value == "":
+        return None
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def write_token(config):
+    import mopidy_funkwhale
+
+    data_dir = mopidy_funkwhale.Extension.get_data_dir(config)
+    with open(os.path.join(data_dir, "token"), "w") as f:
+        json.dump(
+            {
+                "access_token": "benchmark",
+                "refresh_token": "benchmark",
+                "token_type": "Bearer",
+                "expires_in": 36000,
+                "expires_at": time.time() + 36000,
+            },
+            f,
+        )
+
+
+def scenarios(backend, catalogue, rng):
+    library = backend.library
+    playlists = backend.playlists
+    playback = backend.playback
+
+    def random_uri(type, count):
+        return f"funkwhale:{type}:{rng.randint(1, count)}"
+
+    def save_playlist():
+        playlist = playlists.lookup("funkwhale:playlist:1")
+        track = library.lookup(random_uri("track", catalogue.tracks_count))
+        playlists.save(playlist.replace(tracks=list(playlist.tracks) + track))
+
+    return [
+        ("browse albums", 3, lambda: library.browse("funkwhale:directory:/albums")),
+        ("browse artists", 3, lambda: library.browse("funkwhale:directory:/artists")),
+        ("browse album", 50, lambda: library.browse(random_uri("album", catalogue.albums_count))),
+        ("browse artist", 20, lambda: library.browse(random_uri("artist", catalogue.artists_count))),
+        ("lookup track", 200, lambda: library.lookup(random_uri("track", catalogue.tracks_count))),
+        ("search", 50, lambda: library.search({"any": [rng.choice(["track", "album", "artist 1"])]})),
+        (
+            "get_images x50",
+            20,
+            lambda: library.get_images(
+                [random_uri("album", catalogue.albums_count) for _ in range(50)]
+            ),
+        ),
+        ("playlist lookup", 20, lambda: playlists.lookup(random_uri("playlist", len(catalogue.playlists)))),
+        ("playlist save", 10, save_playlist),
+        ("translate_uri", 200, lambda: playback.translate_uri(random_uri("track", catalogue.tracks_count))),
+    ]
+
+
+def percentile(values, percent):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def run(args):
+    started = time.perf_counter()
+    from mopidy_funkwhale.backend import FunkwhaleBackend
+
+    import_ms = (time.perf_counter() - started) * 1000
+
+    catalogue = Catalogue(
+        artists=args.artists,
+        albums=args.albums,
+        tracks_per_album=args.tracks_per_album,
+        playlists=args.playlists,
+        playlist_size=args.playlist_size,
+    )
+    server = FakeFunkwhale(catalogue, latency=args.latency).start()
+    data_dir = tempfile.mkdtemp(prefix="mopidy-funkwhale-bench-")
+    config = make_config(server.url, data_dir, args.option)
+    write_token(config)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    backend = FunkwhaleBackend(config, audio=None)
+    backend.on_start()
+    startup_ms = (time.perf_counter() - started) * 1000
+    if args.warmup:
+        time.sleep(args.warmup)
+
+    rng = random.Random(args.seed)
+    rows = []
+    for name, iterations, call in scenarios(backend, catalogue, rng):
+        if args.only and not any(only in name for only in args.only):
+            continue
+        requests_before = server.total_requests
+        tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        durations = []
+        for _ in range(max(1, iterations * args.scale // 100)):
+            started = time.perf_counter()
+            call()
+            durations.append((time.perf_counter() - started) * 1000)
+        peak = tracemalloc.get_traced_memory()[1] - memory_before
+        rows.append(
+            (
+                name,
+                len(durations),
+                server.total_requests - requests_before,
+                percentile(durations, 50),
+                percentile(durations, 99),
+                peak / 1024 / 1024,
+            )
+        )
+
+    backend.on_stop()
+    server.stop()
+
+    print(
+        f"catalogue: {catalogue.artists_count} artists, {catalogue.albums_count} albums, "
+        f"{catalogue.tracks_count} tracks, latency {args.latency * 1000:.0f}ms"
+    )
+    print(f"startup: backend import {import_ms:.1f}ms, construction and on_start {startup_ms:.1f}ms")
+    print(f"{'scenario':<18}{'calls':>7}{'requests':>10}{'p50 ms':>10}{'p99 ms':>10}{'peak MiB':>10}")
+    for name, calls, requests, p50, p99, peak in rows:
+        print(f"{name:<18}{calls:>7}{requests:>10}{p50:>10.1f}{p99:>10.1f}{peak:>10.1f}")
+    print(f"total requests: {server.total_requests}, {server.bytes_sent / 1024 / 1024:.1f} MiB sent")
+    if args.verbose:
+        for endpoint, count in server.requests.most_common():
+            print(f"  {endpoint:<30}{count:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--artists", type=int, default=200)
+    parser.add_argument("--albums", type=int, default=2000)
+    parser.add_argument("--tracks-per-album", type=int, default=10)
+    parser.add_argument("--playlists", type=int, default=5)
+    parser.add_argument("--playlist-size", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--scale", type=int, default=100, help="percentage of the default iteration counts")
+    parser.add_argument("--warmup", type=float, default=0.0, help="seconds to wait after on_start, to let background work finish")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", action="append", help="only run scenarios whose name contains this")
+    parser.add_argument(
+        "-o", "--option", action="append", default=[], help="[funkwhale] config override, key=value"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="show requests per endpoint")
+    run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
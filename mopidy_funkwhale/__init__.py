@@ -26,15 +26,41 @@ class Extension(ext.Extension):
         schema["token_endpoint"] = mopidy.config.String(optional=True)
         schema["client_secret"] = mopidy.config.String(optional=True)
         schema["client_id"] = mopidy.config.String(optional=True)
+        schema["servers"] = mopidy.config.List(optional=True)
+        schema["server_timeout"] = mopidy.config.Integer(optional=True, minimum=1)
 
         schema["cache_duration"] = mopidy.config.Integer(optional=True)
+        schema["cache_size"] = mopidy.config.Integer(optional=True, minimum=1)
+        schema["model_cache_size"] = mopidy.config.Integer(optional=True, minimum=1)
+        schema["page_size"] = mopidy.config.Integer(optional=True, minimum=1)
+        schema["concurrency"] = mopidy.config.Integer(optional=True, minimum=1)
+        schema["browse_by_letter"] = mopidy.config.Boolean(optional=True)
+        schema["prefetch_count"] = mopidy.config.Integer(optional=True, minimum=0)
+        schema["http_engine"] = mopidy.config.String(
+            optional=True, choices=["requests", "async"]
+        )
+        schema["http_pool_size"] = mopidy.config.Integer(optional=True, minimum=1)
+        schema["http_keepalive"] = mopidy.config.Integer(optional=True, minimum=0)
+        schema["library_index"] = mopidy.config.Boolean(optional=True)
+        schema["search_index"] = mopidy.config.Boolean(optional=True)
+        schema["sync_interval"] = mopidy.config.Integer(optional=True, minimum=0)
+        schema["sync_rate"] = mopidy.config.Integer(optional=True, minimum=1)
+        schema["stream_format"] = mopidy.config.String(optional=True)
+        schema["max_bitrate"] = mopidy.config.Integer(optional=True, minimum=0)
+        schema["stream_overrides"] = mopidy.config.List(optional=True)
+        schema["audio_cache_size"] = mopidy.config.Integer(optional=True, minimum=0)
+        schema["metrics_interval"] = mopidy.config.Integer(optional=True, minimum=1)
+        schema["timeout"] = mopidy.config.Integer(optional=True, minimum=1)
+        schema["retries"] = mopidy.config.Integer(optional=True, minimum=0)
         schema["verify_cert"] = mopidy.config.Boolean(optional=True)
         return schema
 
     def setup(self, registry):
         from .backend import FunkwhaleBackend
+        from .frontend import FunkwhaleFrontend
 
         registry.add("backend", FunkwhaleBackend)
+        registry.add("frontend", FunkwhaleFrontend)
 
     def validate_config(self, config):
         if not config.getboolean("funkwhale", "enabled"):
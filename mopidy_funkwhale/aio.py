@@ -0,0 +1,204 @@
+"""
+Optional asyncio HTTP engine, enabled with ``http_engine = async``.
+
+All requests, whichever thread sends them, run on a single event loop and
+share one httpx connection pool, multiplexed over HTTP/2 when the ``h2``
+package is installed. ``AsyncSession`` exposes the subset of the
+``requests.Session`` interface ``APIClient`` uses, so the rest of the
+backend doesn't know which engine is in use.
+"""
+import asyncio
+import logging
+import threading
+import time
+
+import requests
+
+from .metrics import get_endpoint
+
+
+logger = logging.getLogger(__name__)
+
+# seconds before expiry when a request refreshes the token itself, if the
+# background refresher hasn't already
+REFRESH_MARGIN = 10
+
+
+def is_available():
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def has_http2():
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class Response:
+    """Wrap a ``httpx.Response`` to behave like a ``requests.Response``."""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+        self.url = str(response.url)
+
+    def __bool__(self):
+        return self.ok
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self._response.text
+
+    def json(self, **kwargs):
+        return self._response.json(**kwargs)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(
+                f"{self.status_code} Error for url: {self.url}", response=self
+            )
+
+
+class AsyncSession:
+    """
+    Synchronous facade over a ``httpx.AsyncClient`` running on its own loop thread.
+
+    Authentication is borrowed from ``auth_session``, a requests OAuth2Session.
+    ``refresh`` is called to refresh its token when it is about to expire,
+    it takes the number of seconds left before expiry that call for a
+    refresh and returns whether the token could be refreshed.
+    """
+
+    def __init__(
+        self,
+        url_base,
+        auth_session,
+        pool_size=10,
+        keepalive=30,
+        metrics=None,
+        retry=None,
+        timeout=None,
+        refresh=None,
+    ):
+        import httpx
+
+        self.url_base = url_base
+        self.metrics = metrics
+        self.retry = retry
+        self.timeout = timeout
+        self.auth_session = auth_session
+        self.headers = auth_session.headers
+        self.refresh = refresh
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(
+            target=self._loop.run_forever, name="FunkwhaleHTTP", daemon=True
+        )
+        self._thread.start()
+
+        proxy = auth_session.proxies.get("https") or auth_session.proxies.get("http")
+        http2 = has_http2()
+        if not http2:
+            logger.info("Install the h2 package to use HTTP/2 with Funkwhale")
+
+        async def create_client():
+            return httpx.AsyncClient(
+                http2=http2,
+                verify=auth_session.verify,
+                proxy=proxy or None,
+                limits=httpx.Limits(
+                    max_connections=pool_size,
+                    max_keepalive_connections=pool_size,
+                    keepalive_expiry=keepalive,
+                ),
+                timeout=None,
+            )
+
+        self._client = self._run(create_client())
+        self._httpx = httpx
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    def close(self):
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def _auth_headers(self):
+        token = self.auth_session.token
+        if not token or not token.get("access_token"):
+            return {}
+        expires_at = token.get("expires_at")
+        if expires_at and expires_at < time.time() + REFRESH_MARGIN and self.refresh:
+            # on failure the current token is sent anyway, the server
+            # answers a client error if it did expire
+            self.refresh(margin=REFRESH_MARGIN)
+            token = self.auth_session.token
+        return {"Authorization": f"Bearer {token['access_token']}"}
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None, **kwargs):
+        if not (url.startswith("http://") or url.startswith("https://")):
+            url = self.url_base + url
+        all_headers = dict(self.headers)
+        all_headers.update(self._auth_headers())
+        all_headers.update(headers or {})
+        if timeout is None:
+            timeout = self.timeout
+        endpoint = get_endpoint(url)
+
+        def send():
+            return self._send(method, url, endpoint, params, data, all_headers, timeout)
+
+        if self.retry is None:
+            return send()
+        return self.retry.call(method, endpoint, send)
+
+    def _send(self, method, url, endpoint, params, data, headers, timeout):
+        started = time.monotonic()
+        try:
+            response = self._run(
+                self._client.request(
+                    method,
+                    url,
+                    params=params,
+                    data=data,
+                    headers=headers,
+                    timeout=timeout,
+                )
+            )
+        except self._httpx.HTTPError as e:
+            if self.metrics is not None:
+                self.metrics.inc("http_errors_total", endpoint=endpoint, method=method)
+            raise requests.ConnectionError(str(e)) from e
+        if self.metrics is not None:
+            self.metrics.observe(
+                "http_request_duration_seconds", time.monotonic() - started, endpoint=endpoint
+            )
+            self.metrics.inc(
+                "http_requests_total", endpoint=endpoint, method=method, status=response.status_code
+            )
+            self.metrics.inc("http_response_bytes_total", len(response.content), endpoint=endpoint)
+        return Response(response)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
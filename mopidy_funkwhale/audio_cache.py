@@ -0,0 +1,139 @@
+import collections
+import concurrent.futures
+import logging
+import os
+import pathlib
+import threading
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class AudioCache:
+    """
+    Size capped cache of audio files on disk, keyed by track, see
+    ``backend.get_audio_key``.
+
+    Files are downloaded one at a time in the background, under a temporary
+    name until they are complete. Once more than ``max_size`` bytes are used,
+    the least recently played files are removed.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._files = collections.OrderedDict()
+        self._size = 0
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="FunkwhaleAudioCache"
+        )
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    @classmethod
+    def from_config(cls, config):
+        """Return the cache in the data dir, of ``audio_cache_size`` MiB."""
+        import mopidy_funkwhale
+
+        data_dir = mopidy_funkwhale.Extension.get_data_dir(config)
+        size = config["funkwhale"]["audio_cache_size"]
+        return cls(os.path.join(data_dir, "audio"), size * 1024 * 1024)
+
+    def _load(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".part"):
+                # interrupted download
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self._size += size
+        self._evict()
+
+    def _get_path(self, id):
+        return os.path.join(self.path, str(id))
+
+    def __contains__(self, id):
+        with self._lock:
+            return str(id) in self._files or str(id) in self._pending
+
+    def get_uri(self, id):
+        """Return the ``file://`` URI of the track ``id`` if it is cached, None otherwise."""
+        name = str(id)
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+        path = self._get_path(name)
+        try:
+            # the order is rebuilt from modification times on start
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._size -= self._files.pop(name, 0)
+            return None
+        return pathlib.Path(path).as_uri()
+
+    def fill(self, id, url, session):
+        """Download ``url`` as the audio of the track ``id`` in the background, with ``session``."""
+        name = str(id)
+        with self._lock:
+            if name in self._files or name in self._pending:
+                return
+            self._pending.add(name)
+        self._executor.submit(self._download, name, url, session)
+
+    def _download(self, name, url, session):
+        path = self._get_path(name)
+        tmp = path + ".part"
+        size = 0
+        try:
+            with session.get(url, stream=True) as response:
+                response.raise_for_status()
+                with open(tmp, "wb") as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > self.max_size:
+                            raise OSError("larger than the whole cache")
+                        f.write(chunk)
+            os.replace(tmp, path)
+        except (requests.RequestException, OSError) as e:
+            logger.warning("Could not cache the audio of track %s: %s", name, e)
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        else:
+            with self._lock:
+                self._files[name] = size
+                self._size += size
+                self._evict()
+            logger.debug("Cached the audio of track %s, %d bytes", name, size)
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+    def _evict(self):
+        while self._size > self.max_size and self._files:
+            name, size = self._files.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(self._get_path(name))
+            except OSError:
+                pass
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            return {"files": len(self._files), "size": self._size, "max_size": self.max_size}
@@ -1,67 +1,242 @@
+import bisect
+import collections
+import concurrent.futures
+import datetime
 import logging
+import string
+import threading
+import time
+import unicodedata
 
 import pykka
-import requests
-import requests_oauthlib
-import os
-import datetime
-import json
 
-from mopidy import httpclient, exceptions
 from mopidy import backend, models
-from . import __version__, uri, converter
+from . import cache, servers, uri, converter
+from . import metrics as metrics_module
 
 
-REQUIRED_SCOPES = ["read", "write"] #"read:libraries", "read:favorites", "read:playlists", "write:playlists"]
+logger = logging.getLogger(__name__)
 
 
-class SessionWithUrlBase(requests.Session):
-    # In Python 3 you could place `url_base` after `*args`, but not in Python 2.
-    def __init__(self, url_base=None, *args, **kwargs):
-        super(SessionWithUrlBase, self).__init__(*args, **kwargs)
-        self.url_base = url_base
+class FunkwhalePlaybackProvider(backend.PlaybackProvider):
+    # stream URLs embed the access token, stop using them this many seconds
+    # before it expires
+    TOKEN_EXPIRY_MARGIN = 60
 
-    def request(self, method, url, **kwargs):
-        # Next line of code is here for example purposes only.
-        # You really shouldn't just use string concatenation here,
-        # take a look at urllib.parse.urljoin instead.
-        if url.startswith("http://") or url.startswith("https://"):
-            modified_url = url
-        else:
-            modified_url = self.url_base + url
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stream_urls = cache.TTLCache(
+            maxsize=self.backend.config["funkwhale"].get("cache_size") or 1024,
+            ttl=self.backend.config["funkwhale"].get("cache_duration") or 600,
+        )
+        self.prefetch_count = self.backend.config["funkwhale"].get("prefetch_count")
+        if self.prefetch_count is None:
+            self.prefetch_count = 2
 
-        return super(SessionWithUrlBase, self).request(method, modified_url, **kwargs)
+    def translate_uri(self, p_uri):
+        server = self.backend.get_server(p_uri)
+        if server is None:
+            logger.warning("No Funkwhale server configured for %s", p_uri)
+            return None
+        started = time.monotonic()
+        audio_cache = self.backend.audio_cache
+        url = None
+        if audio_cache is not None:
+            url = audio_cache.get_uri(get_audio_key(p_uri, server.model_cache.stream_policy))
+            self.backend.metrics.inc(
+                "audio_cache_hits_total" if url else "audio_cache_misses_total"
+            )
+        if url is None:
+            url = self._get_remote_url(p_uri)
+            if url and audio_cache is not None:
+                # played from the server this time, from the disk next time
+                audio_cache.fill(
+                    get_audio_key(p_uri, server.model_cache.stream_policy),
+                    url,
+                    server.client.oauth,
+                )
+        elapsed = time.monotonic() - started
+        self.backend.metrics.observe("stream_resolve_duration_seconds", elapsed)
+        logger.debug("Resolved stream URL of %s in %.1fms", p_uri, elapsed * 1000)
+        return url
 
-class OAuth2Session(SessionWithUrlBase, requests_oauthlib.OAuth2Session):
-    pass
+    def _get_remote_url(self, p_uri):
+        url = self._get_stream_url(p_uri)
+        if url is None:
+            listen_url = self.backend.get_server(p_uri).model_cache.get_listen_url(p_uri)
+            if listen_url:
+                url = self._store(p_uri, listen_url)
+            else:
+                url = self._resolve(p_uri)
+        return url
 
-logger = logging.getLogger(__name__)
+    def _cache_audio(self, p_uri):
+        url = self._get_remote_url(p_uri)
+        if url:
+            server = self.backend.get_server(p_uri)
+            self.backend.audio_cache.fill(
+                get_audio_key(p_uri, server.model_cache.stream_policy), url, server.client.oauth
+            )
 
+    def _resolve(self, p_uri):
+        server = self.backend.get_server(p_uri)
+        track = server.client.get_track(uri.get_track_id(p_uri))
+        if track is None:
+            return None
+        record = server.model_cache.add_track(track)
+        return self._store(p_uri, record.listen_url)
 
-class FunkwhalePlaybackProvider(backend.PlaybackProvider):
-    def translate_uri(self, p_uri):
-        id = uri.get_track_id(p_uri)
-        track = self.backend.client.get_track(id)
+    def _get_access_token(self, server):
+        token = server.client.oauth_token
+        return token.get("access_token") if token else None
 
-        if track is None:
+    def _get_stream_url(self, p_uri, count=True):
+        # URLs built with a token that was refreshed since are ignored
+        cached = self.stream_urls.get(p_uri, count=count)
+        if cached is None:
             return None
-        url = track["listen_url"]
+        access_token, url = cached
+        server = self.backend.get_server(p_uri)
+        return url if access_token == self._get_access_token(server) else None
 
+    def _store(self, p_uri, url):
+        server = self.backend.get_server(p_uri)
         if url.startswith("/"):
-            url = self.backend.config["funkwhale"]["url"] + url
-        url += "?token=" + self.backend.client.oauth_token["access_token"]
+            url = server.url + url
+        ttl = self.stream_urls.ttl
+        token = server.client.oauth_token
+        access_token = self._get_access_token(server)
+        if access_token:
+            url += ("&" if "?" in url else "?") + "token=" + access_token
+            if token.get("expires_at"):
+                ttl = min(ttl, token["expires_at"] - time.time() - self.TOKEN_EXPIRY_MARGIN)
+        if ttl > 0:
+            self.stream_urls.set(p_uri, (access_token, url), ttl=ttl)
         return url
 
+    def prefetch(self, p_uris):
+        """
+        Resolve the stream URLs of ``p_uris``, the tracks due to play next
+        according to the frontend, or cache their audio, in the background.
+        """
+        audio_cache = self.backend.audio_cache
+        for next_uri in p_uris[:self.prefetch_count]:
+            server = self.backend.get_server(next_uri)
+            if server is None:
+                continue
+            if audio_cache is not None:
+                key = get_audio_key(next_uri, server.model_cache.stream_policy)
+                if key not in audio_cache:
+                    server.client.submit(self._cache_audio, next_uri)
+            elif (
+                self._get_stream_url(next_uri, count=False) is None
+                and not server.model_cache.get_listen_url(next_uri)
+            ):
+                server.client.submit(self._resolve, next_uri)
+
+
+def get_audio_key(p_uri, policy):
+    """
+    Return the audio cache key of a track URI: its id with the server it
+    comes from and the format and bitrate ``policy`` streams it in, so
+    files streamed under another policy are not played.
+    """
+    key = uri.get_track_id(p_uri)
+    server = uri.get_server(p_uri)
+    if server:
+        key = f"{key}@{server}"
+    return f"{key}.{policy.key}"
+
+
+# above this many operations, saving a playlist rewrites it in two requests
+PLAYLIST_MAX_OPERATIONS = 20
+
+
+def diff_playlist(old, new):
+    """
+    Return the operations turning the ``old`` list of track URIs into ``new``.
+
+    Operations are ``("remove", index)``, ``("add", [uris])`` which appends,
+    and ``("move", from, to)``, to apply in order. Funkwhale can only append,
+    so new tracks are added at the end then moved in place, and only the
+    tracks out of the longest already ordered run are moved.
+    """
+    operations = []
+
+    wanted = collections.Counter(new)
+    current = []
+    removed = []
+    for index, track in enumerate(old):
+        if wanted[track]:
+            wanted[track] -= 1
+            current.append(track)
+        else:
+            removed.append(index)
+    # last first, so the other indexes stay valid
+    operations.extend(("remove", index) for index in reversed(removed))
+
+    added = []
+    for track in new:
+        if wanted[track]:
+            wanted[track] -= 1
+            added.append(track)
+    if added:
+        operations.append(("add", added))
+        current.extend(added)
+
+    # target position of each current track, duplicates keep their order
+    positions = collections.defaultdict(collections.deque)
+    for index, track in enumerate(new):
+        positions[track].append(index)
+    order = [positions[track].popleft() for track in current]
+    stay = longest_increasing_subsequence(order)
+    for target in range(len(new)):
+        if target in stay:
+            continue
+        source = order.index(target)
+        order.pop(source)
+        destination = order.index(target - 1) + 1 if target else 0
+        order.insert(destination, target)
+        if source != destination:
+            operations.append(("move", source, destination))
+    return operations
+
+
+def longest_increasing_subsequence(values):
+    """Return the set of values forming the longest increasing subsequence of ``values``."""
+    tails = []
+    tails_index = []
+    previous = [None] * len(values)
+    for index, value in enumerate(values):
+        position = bisect.bisect_left(tails, value)
+        if position:
+            previous[index] = tails_index[position - 1]
+        if position == len(tails):
+            tails.append(value)
+            tails_index.append(index)
+        else:
+            tails[position] = value
+            tails_index[position] = index
+    result = set()
+    index = tails_index[-1] if tails_index else None
+    while index is not None:
+        result.add(values[index])
+        index = previous[index]
+    return result
+
 
 class FunkwhalePlaylistProvider(backend.PlaylistsProvider):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # (modification_date, playlist) as last seen on the server, to skip
+        # downloading unchanged playlists and to diff against on save
+        self._saved = {}
 
     def as_list(self):
         json = self.backend.client.get_playlists()
         playlists = []
         if json is not None:
-            for playlist in json["results"]:
+            for playlist in json:
                 playlists.append(
                     models.Ref.playlist(
                         uri = uri.get_playlist_uri(playlist["id"]),
@@ -78,55 +253,114 @@ class FunkwhalePlaylistProvider(backend.PlaylistsProvider):
         return None
 
     def save(self, playlist):
-        # Sauvegarder aussi les musiques
-        json = self.backend.client.update_playlist(uri.get_playlist_id(playlist.uri), playlist.name)
-        if json is not None:
-            id = json["id"]
-            tracks = [uri.get_track_id(track.uri) for track in playlist.tracks]
-            self.backend.client.clear_playlist(id)
-            self.backend.client.add_tracks_playlist(id, tracks)
-            return self.lookup(uri.get_playlist_uri(id))
-        return None
+        client = self.backend.client
+        id = uri.get_playlist_id(playlist.uri)
+        # operations are applied by position, so the diff must start from
+        # what the server holds now, not from a cached answer. The tracks
+        # are only downloaded if the playlist changed on the server
+        json = client.get_playlists(id, fresh=True)
+        if json is None:
+            return None
+        saved = self.load(json)
+
+        if playlist.name != saved.name:
+            if client.update_playlist(id, playlist.name) is None:
+                return None
+
+        # what is returned and remembered must match what the server holds
+        tracks = [track for track in playlist.tracks if not uri.get_server(track.uri)]
+        if len(tracks) < len(playlist.tracks):
+            logger.warning(
+                "Playlists only hold tracks of the main Funkwhale server, "
+                "leaving %d tracks of other servers out of %s",
+                len(playlist.tracks) - len(tracks),
+                playlist.uri,
+            )
+            playlist = playlist.replace(tracks=tracks)
+        old = [track.uri for track in saved.tracks]
+        new = [track.uri for track in tracks]
+        operations = diff_playlist(old, new)
+        if len(operations) > PLAYLIST_MAX_OPERATIONS:
+            operations = [("clear",), ("add", new)]
+        for operation in operations:
+            if not self._apply(id, operation):
+                logger.warning("Could not save playlist %s, reloading it", playlist.uri)
+                self._saved.pop(playlist.uri, None)
+                return self.lookup(playlist.uri)
+
+        if playlist.name == saved.name and not operations:
+            return saved
+        # a cheap request, so the next lookup sees the playlist as unchanged
+        json = client.get_playlists(id)
+        if json is None:
+            self._saved.pop(playlist.uri, None)
+            return playlist
+        saved = playlist.replace(last_modified=get_last_modified(json["modification_date"]))
+        self._saved[playlist.uri] = (json["modification_date"], saved)
+        return saved
+
+    def _apply(self, id, operation):
+        client = self.backend.client
+        if operation[0] == "clear":
+            return client.clear_playlist(id)
+        if operation[0] == "add":
+            return client.add_tracks_playlist(id, [uri.get_track_id(u) for u in operation[1]])
+        if operation[0] == "remove":
+            return client.remove_playlist_track(id, operation[1])
+        if operation[0] == "move":
+            return client.move_playlist_track(id, operation[1], operation[2])
 
     def delete(self, p_uri):
+        self._saved.pop(p_uri, None)
         return self.backend.client.delete_playlist(uri.get_playlist_id(p_uri))
 
     def lookup(self, p_uri):
-        id = uri.get_playlist_id(p_uri)
-        json = self.backend.client.get_playlists(id)
-        name = None
-        lenght = None
+        json = self.backend.client.get_playlists(uri.get_playlist_id(p_uri))
+        if json is None:
+            return models.Playlist(uri=p_uri, name=None, tracks=[], last_modified=None)
+        return self.load(json)
+
+    def load(self, json, get_tracks=None):
+        """
+        Return the playlist described by ``json``, only downloading its tracks
+        if it changed, with ``get_tracks`` if given, the client otherwise.
+        """
+        id = json["id"]
+        p_uri = uri.get_playlist_uri(id)
+        name = json["name"]
+        modification_date = json["modification_date"]
+        saved_date, saved = self._saved.get(p_uri, (None, None))
+        if saved is not None and saved_date == modification_date:
+            return saved
+
         tracks = []
-        last_modified = None
+        json = (get_tracks or self.backend.client.get_playlists_tracks)(id)
         if json is not None:
-            # .replace: fix pour fromisoformat qui ne supporte pas le Z
-            last_modified = int(datetime.datetime.fromisoformat(json["modification_date"].replace('Z', '+00:00')).timestamp())
-            name = json["name"]
-            lenght = json["tracks_count"]
-            json = self.backend.client.get_playlists_tracks(id)
-            if json is not None:
-                for track in json["results"]:
-                    tracks.append(
-                        converter.json_to_track(track["track"])
-                    )
-        return models.Playlist(
+            for track in json:
+                tracks.append(
+                    converter.json_to_track(track["track"], self.backend.model_cache)
+                )
+        playlist = models.Playlist(
             uri=p_uri,
             name=name,
             tracks=tracks,
-            last_modified=last_modified
+            last_modified=get_last_modified(modification_date)
         )
+        if json is not None:
+            self._saved[p_uri] = (modification_date, playlist)
+        return playlist
 
     def get_items(self, p_uri):
-        id = uri.get_playlist_id(p_uri)
-        json = self.backend.client.get_playlists_tracks(id)
-        if json is not None:
-            tracks = []
-            for track in json["results"]:
-                tracks.append(
-                    models.Ref.track(uri=uri.get_track_uri(track["track"]["id"]), name=track["track"]["title"])
-                )
-            return tracks
-        return None
+        playlist = self.lookup(p_uri)
+        if playlist.name is None:
+            return None
+        return [models.Ref.track(uri=track.uri, name=track.name) for track in playlist.tracks]
+
+
+def get_last_modified(modification_date):
+    # .replace: fix pour fromisoformat qui ne supporte pas le Z
+    return int(datetime.datetime.fromisoformat(modification_date.replace('Z', '+00:00')).timestamp())
+
 
 def simplify_search_query(query):
 
@@ -144,36 +378,167 @@ def simplify_search_query(query):
         return query
 
 
+SHARDS = list(string.ascii_uppercase) + ["#"]
+
+
+def get_shard(name):
+    """Return the browse sub-directory of a name: its first letter, or # for anything else."""
+    first = unicodedata.normalize("NFKD", name.strip()[:1]).upper()[:1]
+    return first if first and first in string.ascii_uppercase else "#"
+
+
+def merge_refs(results):
+    """Merge the refs listed by each server into one list sorted by name."""
+    if len(results) == 1:
+        return results[0]
+    refs = [ref for refs in results for ref in refs]
+    return sorted(refs, key=lambda ref: (ref.name or "").casefold())
+
+
+def get_album_sort_key(album):
+    """Sort albums by release date, undated ones last, then by title."""
+    release_date = album.get("release_date")
+    return (release_date is None, release_date or "", album["title"].casefold())
+
+
+def get_shard_letter(path):
+    """Return the letter of a ``/albums/A`` like path, None for the top directory."""
+    letter = path.strip("/").partition("/")[2]
+    return letter if letter in SHARDS else None
+
+
+# client method used to find the images of each URI type
+IMAGE_SOURCES = {
+    uri.TRACK: "get_track",
+    uri.ALBUM: "get_album",
+    uri.ARTIST: "get_artist",
+}
+
+CONVERTERS = {
+    uri.TRACK: converter.json_to_track,
+    uri.ALBUM: converter.json_to_album,
+    uri.ARTIST: converter.json_to_artist,
+}
+
+
+# seconds the album and artist listings of a server are kept, split by
+# letter, while the letter sub-directories are opened one after another
+LETTER_LISTING_TTL = 300
+
+
 class FunkwhaleLibraryProvider(backend.LibraryProvider):
     root_directory = models.Ref.directory(uri=uri.get_path_uri("/"), name="Funkwhale")
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # images per URI, including URIs without any image
+        cache_duration = self.backend.config["funkwhale"].get("cache_duration")
+        self.images = None
+        if cache_duration is not None:
+            self.images = cache.TTLCache(
+                maxsize=self.backend.config["funkwhale"].get("cache_size") or 1024,
+                ttl=cache_duration,
+            )
+        # refs by letter, per server and listing
+        self.letter_listings = cache.TTLCache(maxsize=64, ttl=LETTER_LISTING_TTL)
+        self._listing_in_flight = cache.SingleFlight()
+
+    @property
+    def catalogue(self):
+        # Answer from the local index once it has been filled, from the server otherwise
+        if self.backend.index is not None and self.backend.index.ready:
+            return self.backend.index
+        return self.backend.client
+
+    def get_catalogue(self, server):
+        # only the main server is indexed
+        if server is self.backend.server:
+            return self.catalogue
+        return server.client
+
     def search(self, query=None, uris=None, exact=False):
-        # TODO Support exact search
         if not query:
             return
 
+        results = self.backend.fan_out(
+            lambda server: self._search(server, query, uris, exact)
+        )
+        results = [result for result in results if result is not None]
+        if len(results) < 2:
+            return results[0] if results else None
+        return models.SearchResult(
+            uri="funkwhale:search",
+            tracks=[track for result in results for track in result.tracks],
+            albums=[album for result in results for album in result.albums],
+            artists=[artist for result in results for artist in result.artists],
+        )
+
+    def _search(self, server, query, uris, exact):
+        search_index = self.backend.search_index
+        if (
+            server is self.backend.server
+            and search_index is not None
+            and search_index.ready
+            and isinstance(query, dict)
+        ):
+            logger.debug("Searching the local index for: %s", query)
+            ids = search_index.search(query, uris=uris, exact=exact)
+            raw_results = {
+                kind: self.backend.index.get_many(kind, ids[kind]) for kind in ids
+            }
         else:
+            # the server search knows nothing about fields, exact or uris
             search_query = simplify_search_query(query)
-            logger.info("Searching Funkwhale for: %s", search_query)
-            raw_results = self.backend.client.search(search_query)
-            if raw_results is None:
-                return None
-            artists = [converter.json_to_artist(row) for row in raw_results["artists"]]
-            albums = [converter.json_to_album(row) for row in raw_results["albums"]]
-            tracks = [] #[converter.json_to_track(row) for row in raw_results["tracks"]]
-            for track in raw_results["tracks"]:
-                tracks.append(converter.json_to_track(track))
-            return models.SearchResult(
-                uri="funkwhale:search", tracks=tracks, albums=albums, artists=artists
-            )
+            logger.info("Searching %s for: %s", server.url, search_query)
+            raw_results = self.get_catalogue(server).search(search_query)
+        if raw_results is None:
+            return None
+        model_cache = server.model_cache
+        artists = [converter.json_to_artist(row, model_cache) for row in raw_results["artists"]]
+        albums = [converter.json_to_album(row, model_cache) for row in raw_results["albums"]]
+        tracks = [] #[converter.json_to_track(row) for row in raw_results["tracks"]]
+        for track in raw_results["tracks"]:
+            tracks.append(converter.json_to_track(track, model_cache))
+        return models.SearchResult(
+            uri="funkwhale:search", tracks=tracks, albums=albums, artists=artists
+        )
 
     def lookup(self, p_uri):
-        tracks = []
-        id = uri.get_track_id(p_uri)
-        json = self.backend.client.get_track(id)
-        if json is not None:
-            tracks.append(converter.json_to_track(json))
-        return tracks
+        """
+        Return the tracks of ``p_uri``, album, artist and playlist URIs are
+        expanded to their tracks.
+
+        Mopidy looks URIs up one at a time. Tracks listed in an earlier
+        album, playlist, search or browse answer are in the model cache and
+        returned without a request, which is what makes adding many of them
+        to the tracklist cheap.
+        """
+        server = self.backend.get_server(p_uri)
+        if server is None:
+            logger.warning("No Funkwhale server configured for %s", p_uri)
+            return []
+        if uri.get_type(p_uri) == uri.TRACK:
+            track = server.model_cache.get(p_uri)
+            if track is not None:
+                return [track]
+        return self._lookup(p_uri, server)
+
+    def _lookup(self, p_uri, server):
+        type = uri.get_type(p_uri)
+        if type == uri.TRACK:
+            json = self._fetch("get_track", uri.get_track_id(p_uri), server)
+            json = [json] if json is not None else None
+        elif type == uri.ALBUM:
+            json = self._fetch("get_album_tracks", uri.get_album_id(p_uri), server)
+        elif type == uri.ARTIST:
+            json = self._fetch("get_artist_tracks", uri.get_artist_id(p_uri), server)
+        elif type == uri.PLAYLIST:
+            return list(self.backend.playlists.lookup(p_uri).tracks)
+        else:
+            json = None
+        if json is None:
+            return []
+        return [converter.json_to_track(track, server.model_cache) for track in json]
 
     def browse(self, p_uri):
         if uri.get_type(p_uri) == uri.PATH:
@@ -181,15 +546,18 @@ class FunkwhaleLibraryProvider(backend.LibraryProvider):
             if path == "/":
                 return self._get_root_dirs()
             if path.startswith("/albums"):
-                return self._get_albums()
+                return self._get_albums(get_shard_letter(path))
             if path.startswith("/artists"):
-                return self._get_artists()
+                return self._get_artists(get_shard_letter(path))
             if path.startswith("/favorites"):
                 return self._get_favorites()
+        server = self.backend.get_server(p_uri)
+        if server is None:
+            return []
         if uri.get_type(p_uri) == uri.ALBUM:
-            return self._get_album(p_uri)
+            return self._get_album(p_uri, server)
         if uri.get_type(p_uri) == uri.ARTIST:
-            return self._get_artist(p_uri)
+            return self._get_artist(p_uri, server)
         return []
 
     def _get_root_dirs(self):
@@ -200,223 +568,289 @@ class FunkwhaleLibraryProvider(backend.LibraryProvider):
         ]
 
     def _get_favorites(self):
-        json = self.backend.client.get_favorites()
+        results = self.backend.fan_out(self._get_server_favorites, timeout=False)
+        return [ref for refs in results for ref in refs]
+
+    def _get_server_favorites(self, server):
+        json = self.get_catalogue(server).get_favorites()
         tracks = []
         if json is not None:
             for track in json:
-                tracks.append(models.Ref.track(uri=uri.get_track_uri(track["id"]), name=track["title"]))
+                tracks.append(
+                    models.Ref.track(
+                        uri=uri.get_track_uri(track["id"], server.name), name=track["title"]
+                    )
+                )
         return tracks
 
-    def _get_album(self, p_uri):
-        json = self.backend.client.get_album_tracks(uri.get_id(p_uri))
+    def _get_album(self, p_uri, server):
+        json = self._fetch("get_album_tracks", uri.get_id(p_uri), server)
         if json is not None:
-            return [converter.json_to_track_ref(track) for track in json]
+            return [converter.json_to_track_ref(track, server.model_cache) for track in json]
         return []
 
-    def _get_albums(self):
-        json = self.backend.client.get_albums()
-        albums = []
-        if json is not None:
-            for album in json:
-                albums.append(models.Ref.album(uri=uri.get_album_uri(album["id"]), name=album["title"]))
-        return albums
+    def _get_albums(self, letter=None):
+        if letter is None and self.backend.config["funkwhale"].get("browse_by_letter"):
+            return self._get_shards("/albums")
+        return merge_refs(
+            self.backend.fan_out(
+                lambda server: self._get_server_albums(server, letter), timeout=False
+            )
+        )
 
-    def _get_artists(self):
-        json = self.backend.client.get_artists()
-        artists = []
-        if json is not None:
-            for artist in json:
-                artists.append(models.Ref.artist(uri=uri.get_artist_uri(artist["id"]), name=artist["name"]))
-        return artists
+    def _get_server_albums(self, server, letter=None):
+        if letter is not None:
+            return self._get_letter_listing(server, "albums").get(letter, [])
+        albums = self.get_catalogue(server).iter_albums()
+        return [converter.json_to_album_ref(album, server.model_cache) for album in albums]
+
+    def _get_artists(self, letter=None):
+        if letter is None and self.backend.config["funkwhale"].get("browse_by_letter"):
+            return self._get_shards("/artists")
+        return merge_refs(
+            self.backend.fan_out(
+                lambda server: self._get_server_artists(server, letter), timeout=False
+            )
+        )
+
+    def _get_server_artists(self, server, letter=None):
+        if letter is not None:
+            return self._get_letter_listing(server, "artists").get(letter, [])
+        artists = self.get_catalogue(server).iter_artists()
+        return [converter.json_to_artist_ref(artist, server.model_cache) for artist in artists]
+
+    def _get_letter_listing(self, server, kind):
+        """
+        Return the album or artist refs of ``server`` by letter. The server
+        can only list everything, so the listing is downloaded once for
+        all the letters, the local index is read again each time.
+        """
+        catalogue = self.get_catalogue(server)
+        if catalogue is self.backend.index:
+            return self._split_listing(server, kind, catalogue) or {}
+        key = (server.name, kind)
+        listing = self.letter_listings.get(key)
+        if listing is None:
+
+            def fetch():
+                listing = self._split_listing(server, kind, catalogue)
+                if listing is not None:
+                    self.letter_listings.set(key, listing)
+                return listing
+
+            listing, _ = self._listing_in_flight.do(key, fetch)
+        return listing or {}
+
+    def _split_listing(self, server, kind, catalogue):
+        # None when the listing could not be fetched, so it isn't kept
+        if kind == "albums":
+            items, name, to_ref = catalogue.get_albums(), "title", converter.json_to_album_ref
+        else:
+            items, name, to_ref = catalogue.get_artists(), "name", converter.json_to_artist_ref
+        if items is None:
+            return None
+        listing = collections.defaultdict(list)
+        for item in items:
+            listing[get_shard(item[name])].append(to_ref(item, server.model_cache))
+        return dict(listing)
 
-    def _get_artist(self, p_uri):
-        json = self.backend.client.get_artist_tracks(uri.get_id(p_uri))
+    def _get_shards(self, path):
+        return [
+            models.Ref.directory(uri=uri.get_path_uri(f"{path}/{letter}"), name=letter)
+            for letter in SHARDS
+        ]
+
+    def _get_artist(self, p_uri, server):
+        # albums only, their tracks are fetched when they are opened
+        json = self._fetch("get_artist_albums", uri.get_id(p_uri), server)
         if json is not None:
-            return [converter.json_to_track_ref(track) for track in json]
+            albums = sorted(json, key=get_album_sort_key)
+            return [converter.json_to_album_ref(album, server.model_cache) for album in albums]
         return []
 
     def get_images(self, p_uris):
         images = dict()
+        missing = collections.defaultdict(list)
         for p_uri in p_uris:
-            id = uri.get_track_id(p_uri)
-            if uri.get_type(p_uri) == uri.ALBUM:
-                json = self.backend.client.get_album(id)
-                if json is not None:
-                    images.update({p_uri:[
-                        converter.json_to_image(json["cover"]["urls"]["original"])
-                    ]})
+            server = self.backend.get_server(p_uri)
+            if server is None:
+                continue
+            cached = self.images.get(p_uri) if self.images is not None else None
+            if cached is None:
+                # known from an earlier payload, an empty list may only mean
+                # that payload left the cover out
+                cached = server.model_cache.get_images(p_uri) or None
+            if cached is not None:
+                if cached:
+                    images[p_uri] = cached
+            elif uri.get_type(p_uri) in IMAGE_SOURCES:
+                missing[server, uri.get_type(p_uri)].append(uri.get_id(p_uri))
+
+        for (server, type), ids in missing.items():
+            fetched = self.backend.client.fetch_many(
+                lambda id: self._fetch(IMAGE_SOURCES[type], id, server), ids
+            )
+            for id, json in fetched.items():
+                if json is None:
+                    # don't remember failed requests
+                    continue
+                p_uri = uri.get_uri(type, id, server.name)
+                CONVERTERS[type](json, server.model_cache)
+                result = converter.json_to_images(json)
+                if self.images is not None:
+                    self.images.set(p_uri, result)
+                if result:
+                    images[p_uri] = result
         return images
 
+    def _fetch(self, method, id, server=None):
+        server = server or self.backend.server
+        catalogue = self.get_catalogue(server)
+        json = getattr(catalogue, method)(id)
+        if json is None and catalogue is not server.client:
+            # not indexed yet
+            json = getattr(server.client, method)(id)
+        return json
 
-class APIClient:
-    def __init__(self, config):
-        self.config = config
-        self.jwt_token = None
-        self.oauth_token = get_token(config)
-
-        base_url = config["funkwhale"]["url"]
-
-        if not base_url.endswith("/api/v1/"):
-           base_url += "/api/v1/"
-        proxy = httpclient.format_proxy(config["proxy"])
-        full_user_agent = httpclient.format_user_agent("%s/%s" % ("Mopidy-Funkwhale", __version__))
-
-        self.session = OAuth2Session(
-            url_base = base_url,
-            client_id=self.config["funkwhale"]["client_id"],
-            token=self.oauth_token,
-            auto_refresh_url=config["funkwhale"]["url"]
-                + config["funkwhale"].get("token_endpoint")
-                or "/api/v1/oauth/token/",
-            auto_refresh_kwargs={
-                "client_id": self.config["funkwhale"]["client_id"],
-                "client_secret": self.config["funkwhale"]["client_secret"],
-            },
-            token_updater=self.refresh_token,
-
-        )
-
-        self.session.proxies.update({"http": proxy, "https": proxy})
-        self.session.headers.update({"user-agent": full_user_agent})
-
-        self.session.verify = config["funkwhale"].get("verify_cert", True)
-
-    def refresh_token(self, token):
-        self.oauth_token = token
-        set_token(token, self.config)
-
-    def get_favorites(self):
-        response = self.session.get("tracks/?favorites=true&ordering=-creation_date&page=1&page_size=50")
-        results = []
-        results.extend(response.json()["results"])
-        while response and response.json()["next"] is not None:
-            response = self.session.get(response.json()["next"])
-            results.extend(response.json()["results"])
-        return results
-
-    def get_playlists(self, id=None):
-        if id is None:
-            response = self.session.get("playlists/")
-            if response:
-                return response.json()
-        if id:
-            response = self.session.get(f"playlists/{id}")
-            if response:
-                return response.json()
-        return None
-
-    def get_playlists_tracks(self, id):
-        response = self.session.get(f"playlists/{id}/tracks")
-        if response:
-            return response.json()
-
-    def get_track(self, id):
-        response = self.session.get(f"tracks/{id}")
-        if response:
-            return response.json()
-
-    def get_albums(self):
-        response = self.session.get("albums/?ordering=title&page=1&page_size=50&scope=all")
-        results = []
-        results.extend(response.json()["results"])
-        while response and response.json()["next"] is not None:
-            response = self.session.get(response.json()["next"])
-            results.extend(response.json()["results"])
-        return results
-
-    def get_artists(self):
-        response = self.session.get("artists/?ordering=name&page=1&page_size=50&scope=all")
-        results = []
-        results.extend(response.json()["results"])
-        while response and response.json()["next"] is not None:
-            response = self.session.get(response.json()["next"])
-            results.extend(response.json()["results"])
-        return results
-
-    def get_album_tracks(self, id):
-        response = self.session.get(f"tracks/?page_size=50&album={id}&ordering=disc_number,position")
-        results = []
-        results.extend(response.json()["results"])
-        while response and response.json()["next"] is not None:
-            response = self.session.get(response.json()["next"])
-            results.extend(response.json()["results"])
-        return results
-
-    def get_artist_tracks(self, id):
-        response = self.session.get(f"tracks/?page_size=50&artist={id}&ordering=title")
-        results = []
-        results.extend(response.json()["results"])
-        while response and response.json()["next"] is not None:
-            response = self.session.get(response.json()["next"])
-            results.extend(response.json()["results"])
-        return results
-
-    def get_album(self, id):
-        response = self.session.get(f"albums/{id}")
-        if response:
-            return response.json()
-
-    def create_playlist(self, name):
-        response = self.session.post("playlists/", data = {"name": name})
-        if response:
-            return response.json()
-
-    def update_playlist(self, id, name):
-        response = self.session.patch(f"playlists/{id}", data={"name": name})
-        if response:
-            return response.json()
-
-    def delete_playlist(self, id):
-        return bool(self.session.delete(f"playlists/{id}"))
-
-    def clear_playlist(self, id):
-        return bool(self.session.delete(f"playlists/{id}/clear"))
-
-    def add_tracks_playlist(self, id, tracks):
-        return bool(self.session.post(f"playlists/{id}/add", data={"tracks": tracks, "allow_duplicates": True}))
-
-    def search(self, query):
-        response = self.session.get("search", params={"query": query})
-        if response:
-            return response.json()
 
 class FunkwhaleBackend(pykka.ThreadingActor, backend.Backend):
     uri_schemes = ["funkwhale"]
 
     def __init__(self, config, audio):
         super().__init__()
+        self._created_at = time.monotonic()
         self.config = config
-        self.client = APIClient(config)
+        self.metrics = metrics_module.Metrics()
+        # their clients are built on first use
+        self.servers = servers.from_config(config, self.metrics)
+        self.server = self.servers[None]
+        self.model_cache = self.server.model_cache
+        self.server_timeout = config["funkwhale"].get("server_timeout") or 5
+        self._fan_out_executor = None
+        if len(self.servers) > 1:
+            # room for a few calls per server, so a server that stopped
+            # answering doesn't hold up the next calls to the others
+            self._fan_out_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=4 * len(self.servers), thread_name_prefix="FunkwhaleFanOut"
+            )
+        self.index = None
+        self.search_index = None
+        if config["funkwhale"].get("library_index"):
+            from . import index, search
+
+            self.index = index.LibraryIndex.from_config(config)
+            if config["funkwhale"].get("search_index"):
+                self.search_index = search.SearchIndex()
+        self.sync = None
+        sync_interval = config["funkwhale"].get("sync_interval")
+        if self.index is not None or sync_interval:
+            from . import sync
+
+            self.sync = sync.LibrarySync(
+                self, interval=sync_interval, rate=config["funkwhale"].get("sync_rate")
+            )
+        self.audio_cache = None
+        if config["funkwhale"].get("audio_cache_size"):
+            from . import audio_cache
+
+            self.audio_cache = audio_cache.AudioCache.from_config(config)
+        self.exporter = None
+        metrics_interval = config["funkwhale"].get("metrics_interval")
+        if metrics_interval:
+            self.exporter = metrics_module.Exporter(
+                self.metrics, metrics_module.get_metrics_path(config), metrics_interval
+            )
         self.library = FunkwhaleLibraryProvider(backend=self)
         self.playback = FunkwhalePlaybackProvider(audio=audio, backend=self)
         self.playlists = FunkwhalePlaylistProvider(backend=self)
 
-    def on_start(self):
-        if self.config["funkwhale"]["client_id"]:
-            logger.info('Using OAuth2 connection"')
-        else:
-            logger.info('Using "%s" anonymously', self.config["funkwhale"]["url"])
-
-def get_token(config):
-    import mopidy_funkwhale
-
-    data_dir = mopidy_funkwhale.Extension.get_data_dir(config)
-    try:
-        with open(os.path.join(data_dir, "token"), "r") as f:
-            raw = f.read()
-    except IOError:
-        return None
-    try:
-        return json.loads(raw)
-    except (TypeError, ValueError):
-        logger.error("Cannot decode token data, you may need to relogin")
-
-
-def set_token(token_data, config):
-    import mopidy_funkwhale
+    @property
+    def client(self):
+        """Client of the main server, the only one holding playlists and the index."""
+        return self.server.client
+
+    def get_server(self, p_uri):
+        """Return the server of ``p_uri``, None if it isn't configured anymore."""
+        return self.servers.get(uri.get_server(p_uri))
+
+    def fan_out(self, fetch, timeout=True):
+        """
+        Call ``fetch`` on every server concurrently and return the results,
+        in the order they arrive. Servers that fail, or don't answer within
+        ``server_timeout`` seconds, are left out. With ``timeout`` false,
+        for full listings of many pages, every server is waited for, each
+        request being bounded by the client timeout.
+        """
+        if self._fan_out_executor is None:
+            return [fetch(self.server)]
+        futures = {
+            self._fan_out_executor.submit(fetch, server): server
+            for server in self.servers.values()
+        }
+        results = []
+        try:
+            for future in concurrent.futures.as_completed(
+                futures, timeout=self.server_timeout if timeout else None
+            ):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.warning("Funkwhale server %s failed: %s", futures[future].url, e)
+        except concurrent.futures.TimeoutError:
+            for future, server in futures.items():
+                if not future.done():
+                    self.metrics.inc("server_timeouts_total", server=server.name or "main")
+                    logger.warning(
+                        "Funkwhale server %s didn't answer within %ds, leaving it out",
+                        server.url,
+                        self.server_timeout,
+                    )
+        return results
 
-    data_dir = mopidy_funkwhale.Extension.get_data_dir(config)
-    print(data_dir)
-    content = json.dumps(token_data)
-    with open(os.path.join(data_dir, "token"), "w") as f:
-        f.write(content)
+    def on_start(self):
+        for server in self.servers.values():
+            if server.config["funkwhale"]["client_id"]:
+                logger.info('Using "%s" with OAuth2', server.url)
+            else:
+                logger.info('Using "%s" anonymously', server.url)
+        if self.sync is not None:
+            self.sync.start()
+        if self.exporter is not None:
+            self.exporter.start()
+        for server in self.servers.values():
+            threading.Thread(
+                target=self._warm_up, args=(server,), name="FunkwhaleWarmUp", daemon=True
+            ).start()
+        elapsed = time.monotonic() - self._created_at
+        self.metrics.observe("startup_duration_seconds", elapsed)
+        logger.debug("Funkwhale backend started in %.1fms", elapsed * 1000)
+
+    def _warm_up(self, server):
+        # the client, its connection and the token are ready before the
+        # first user request
+        started = time.monotonic()
+        server.client.warm_up()
+        elapsed = time.monotonic() - started
+        self.metrics.observe("warm_up_duration_seconds", elapsed)
+        logger.debug("Funkwhale client of %s warmed up in %.1fms", server.url, elapsed * 1000)
+
+    def on_stop(self):
+        if self.sync is not None:
+            from . import sync
+
+            self.sync.stop(timeout=sync.STOP_TIMEOUT)
+        if self.exporter is not None:
+            self.exporter.stop()
+        if self.audio_cache is not None:
+            self.audio_cache.close()
+        if self._fan_out_executor is not None:
+            self._fan_out_executor.shutdown(wait=False)
+        for server in self.servers.values():
+            server.close()
+        if self.index is not None:
+            if self.sync is not None and self.sync.is_alive():
+                # still waiting for the server, the index is left open
+                # rather than closed under its feet
+                logger.warning("Funkwhale library sync did not stop in time")
+            else:
+                self.index.close()
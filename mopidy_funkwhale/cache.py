@@ -0,0 +1,188 @@
+import collections
+import concurrent.futures
+import threading
+import time
+
+from mopidy import models
+
+from . import records
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after ``ttl`` seconds.
+
+    A ``ttl`` of 0 keeps entries until they are evicted by the size limit.
+    """
+
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not None
+
+    def get(self, key, default=None, count=True, stale=False):
+        """
+        Return the value cached for ``key``, or ``default``.
+
+        Expired entries stay until they are evicted by the size limit,
+        ``stale`` returns them too.
+        """
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                if count:
+                    self.misses += 1
+                return default
+            if expires and expires < time.monotonic() and not stale:
+                if count:
+                    self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else 0
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, prefix):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls: while ``fetch`` runs for a key, other callers
+    asking for the same key wait for it and share its result, or its exception.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, fetch):
+        """Return ``(result, shared)``, ``shared`` telling whether another call fetched it."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is None:
+                future = self._calls[key] = concurrent.futures.Future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            return future.result(), True
+        try:
+            result = fetch()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class ModelCache:
+    """
+    Identity map of the catalogue entries seen in API payloads, keyed by URI.
+
+    Entries are kept as compact ``records``, tracks sharing the records of
+    their artist and album, and turned into mopidy models on ``get``. Records
+    also keep what models have no field for: the cover and, for tracks, the
+    stream URL. ``server`` names the server the entries come from, None
+    for the main one.
+    """
+
+    def __init__(self, maxsize=10000, stream_policy=None, server=None):
+        self._entries = TTLCache(maxsize=maxsize, ttl=0)
+        self.stream_policy = stream_policy
+        self.server = server
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, record):
+        previous = self._entries.get(record.uri, count=False)
+        if previous is None:
+            self._entries.set(record.uri, record)
+            return record
+        # update in place, so the tracks pointing to an artist or album record
+        # see the change, and a partial payload doesn't forget what a fuller
+        # one gave us
+        for field in record.__slots__:
+            value = getattr(record, field)
+            if value is not None:
+                setattr(previous, field, value)
+        return previous
+
+    def add_artist(self, json):
+        return self._add(records.ArtistRecord.from_json(json, self.server))
+
+    def add_album(self, json):
+        artist = self.add_artist(json["artist"])
+        return self._add(records.AlbumRecord.from_json(json, artist, self.server))
+
+    def add_track(self, json):
+        artist = self.add_artist(json["artist"])
+        album = self.add_album(json["album"])
+        return self._add(
+            records.TrackRecord.from_json(
+                json, artist, album, self.stream_policy, self.server
+            )
+        )
+
+    def get_record(self, uri):
+        return self._entries.get(uri)
+
+    def get(self, uri):
+        record = self.get_record(uri)
+        return record.to_model() if record is not None else None
+
+    def get_images(self, uri):
+        record = self.get_record(uri)
+        if record is None:
+            return None
+        cover = record.get_cover()
+        return [models.Image(uri=cover)] if cover else []
+
+    def get_listen_url(self, uri):
+        record = self.get_record(uri)
+        return getattr(record, "listen_url", None)
+
+    def stats(self):
+        return self._entries.stats()
@@ -0,0 +1,566 @@
+"""
+HTTP client of the Funkwhale API.
+
+Kept apart from the backend, and imported on first use, so that loading
+the extension doesn't pay for requests, oauthlib and the session setup.
+"""
+import collections
+import concurrent.futures
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import requests
+import requests_oauthlib
+from oauthlib.oauth2 import OAuth2Error
+from mopidy import httpclient
+
+from . import __version__, cache, decode, retry
+from . import metrics as metrics_module
+
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_SCOPES = ["read", "write"] #"read:libraries", "read:favorites", "read:playlists", "write:playlists"]
+
+
+class SessionWithUrlBase(requests.Session):
+    # In Python 3 you could place `url_base` after `*args`, but not in Python 2.
+    def __init__(self, url_base=None, *args, **kwargs):
+        super(SessionWithUrlBase, self).__init__(*args, **kwargs)
+        self.url_base = url_base
+        self.metrics = None
+        self.retry = None
+        self.timeout = None
+
+    def request(self, method, url, **kwargs):
+        # Next line of code is here for example purposes only.
+        # You really shouldn't just use string concatenation here,
+        # take a look at urllib.parse.urljoin instead.
+        if url.startswith("http://") or url.startswith("https://"):
+            modified_url = url
+        else:
+            modified_url = self.url_base + url
+        if self.timeout:
+            kwargs.setdefault("timeout", self.timeout)
+
+        if self.retry is None:
+            return self._send(method, modified_url, **kwargs)
+        return self.retry.call(
+            method,
+            metrics_module.get_endpoint(modified_url),
+            lambda: self._send(method, modified_url, **kwargs),
+        )
+
+    def _send(self, method, modified_url, **kwargs):
+        if self.metrics is None:
+            return super(SessionWithUrlBase, self).request(method, modified_url, **kwargs)
+        endpoint = metrics_module.get_endpoint(modified_url)
+        started = time.monotonic()
+        try:
+            response = super(SessionWithUrlBase, self).request(method, modified_url, **kwargs)
+        except requests.RequestException:
+            self.metrics.inc("http_errors_total", endpoint=endpoint, method=method)
+            raise
+        self.metrics.observe(
+            "http_request_duration_seconds", time.monotonic() - started, endpoint=endpoint
+        )
+        self.metrics.inc(
+            "http_requests_total", endpoint=endpoint, method=method, status=response.status_code
+        )
+        if not kwargs.get("stream"):
+            # reading a streamed body here would load it all in memory
+            self.metrics.inc("http_response_bytes_total", len(response.content), endpoint=endpoint)
+        return response
+
+class OAuth2Session(SessionWithUrlBase, requests_oauthlib.OAuth2Session):
+    pass
+
+
+class TokenRefresher(threading.Thread):
+    """
+    Refresh the OAuth token ``REFRESH_MARGIN`` seconds before it expires, so
+    requests and stream URLs never wait for, or miss, a refresh.
+    """
+
+    REFRESH_MARGIN = 300
+    RETRY_DELAY = 30
+
+    def __init__(self, client):
+        super().__init__(name="FunkwhaleToken", daemon=True)
+        self.client = client
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            token = self.client.oauth_token
+            if not token or not token.get("refresh_token") or not token.get("expires_at"):
+                return
+            delay = token["expires_at"] - self.REFRESH_MARGIN - time.time()
+            if delay > 0:
+                # woken up early by stop(), or the token may have been
+                # refreshed by a request meanwhile, check again
+                self._stop_event.wait(delay)
+            elif not self.client.refresh():
+                self._stop_event.wait(self.RETRY_DELAY)
+
+
+class APIClient:
+    def __init__(self, config, metrics=None):
+        self.config = config
+        self.metrics = metrics or metrics_module.Metrics()
+        self.jwt_token = None
+        self._refresh_lock = threading.Lock()
+        self._refresher = None
+
+        base_url = config["funkwhale"]["url"]
+
+        if not base_url.endswith("/api/v1/"):
+           base_url += "/api/v1/"
+        proxy = httpclient.format_proxy(config["proxy"])
+        full_user_agent = httpclient.format_user_agent("%s/%s" % ("Mopidy-Funkwhale", __version__))
+
+        self.session = OAuth2Session(
+            url_base = base_url,
+            client_id=self.config["funkwhale"]["client_id"],
+            token=get_token(config),
+            auto_refresh_url=config["funkwhale"]["url"]
+                + config["funkwhale"].get("token_endpoint")
+                or "/api/v1/oauth/token/",
+            auto_refresh_kwargs={
+                "client_id": self.config["funkwhale"]["client_id"],
+                "client_secret": self.config["funkwhale"]["client_secret"],
+            },
+            token_updater=self.refresh_token,
+
+        )
+        # every engine, and the stream URLs, use the token of this session
+        self.oauth = self.session
+
+        self.session.proxies.update({"http": proxy, "https": proxy})
+        self.session.headers.update({"user-agent": full_user_agent})
+
+        self.session.verify = config["funkwhale"].get("verify_cert", True)
+        self.session.metrics = self.metrics
+        retries = config["funkwhale"].get("retries")
+        self.retry = retry.Retry(
+            retries=2 if retries is None else retries, metrics=self.metrics
+        )
+        self.session.retry = self.retry
+        self.session.timeout = config["funkwhale"].get("timeout") or 10
+
+        self.page_size = config["funkwhale"].get("page_size") or 50
+        self.concurrency = config["funkwhale"].get("concurrency") or 4
+        self._pages_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="FunkwhalePages"
+        )
+        # kept apart from the pages pool: a fetch may itself walk pages
+        self._requests_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="FunkwhaleRequests"
+        )
+        # by default, one pooled connection per worker, plus one for the calling thread
+        pool_size = config["funkwhale"].get("http_pool_size") or 2 * self.concurrency + 1
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        if config["funkwhale"].get("http_engine") == "async":
+            from . import aio
+
+            if aio.is_available():
+                # API calls go through the async engine, the OAuth2 session
+                # still holds the token and is refreshed by refresh()
+                self.session = aio.AsyncSession(
+                    base_url,
+                    self.session,
+                    metrics=self.metrics,
+                    retry=self.retry,
+                    timeout=self.session.timeout,
+                    pool_size=pool_size,
+                    keepalive=config["funkwhale"].get("http_keepalive") or 30,
+                    refresh=self.refresh,
+                )
+            else:
+                logger.warning(
+                    "http_engine is set to async but httpx is not installed, using requests"
+                )
+
+        self._in_flight = cache.SingleFlight()
+
+        # cache_duration: 0 caches forever, empty disables the cache
+        cache_duration = config["funkwhale"].get("cache_duration")
+        if cache_duration is None:
+            self.cache = None
+        else:
+            self.cache = cache.TTLCache(
+                maxsize=config["funkwhale"].get("cache_size") or 1024,
+                ttl=cache_duration,
+            )
+
+    @property
+    def oauth_token(self):
+        return self.oauth.token or None
+
+    def close(self):
+        if self._refresher is not None:
+            self._refresher.stop()
+        self._pages_executor.shutdown(wait=False)
+        self._requests_executor.shutdown(wait=False)
+        self.session.close()
+
+    def warm_up(self):
+        """Start refreshing the token in the background and open a connection to the server."""
+        token = self.oauth_token
+        if self._refresher is None and token and token.get("refresh_token"):
+            self._refresher = TokenRefresher(self)
+            self._refresher.start()
+        try:
+            self.session.get("instance/nodeinfo/2.0/")
+        except requests.RequestException as e:
+            logger.debug("Could not reach the Funkwhale server: %s", e)
+
+    def _cached(self, key, fetch):
+        """
+        Return the cached result of ``fetch``, or fetch and cache it.
+
+        ``fetch`` returns None when the server doesn't have the item, and
+        raises a requests exception when the server fails, in which case
+        an expired result is returned if there is one.
+        """
+        endpoint = metrics_module.get_endpoint(key)
+        if self.cache is not None:
+            result = self.cache.get(key)
+            if result is not None:
+                self.metrics.inc("cache_hits_total", endpoint=endpoint)
+                return result
+            self.metrics.inc("cache_misses_total", endpoint=endpoint)
+
+        def fetch_and_store():
+            # stored before waiting callers are released, so that callers
+            # arriving in between find it in the cache
+            result = fetch()
+            if result is not None and self.cache is not None:
+                self.cache.set(key, result)
+            return result
+
+        try:
+            return self._coalesced(key, endpoint, fetch_and_store)
+        except requests.RequestException as e:
+            logger.warning("Could not fetch %s: %s", key, e)
+            if self.cache is None or is_client_error(e):
+                # gone or forbidden, not worth an outdated answer
+                return None
+        # the server is failing, an outdated answer beats none
+        result = self.cache.get(key, count=False, stale=True)
+        if result is not None:
+            self.metrics.inc("cache_stale_total", endpoint=endpoint)
+        return result
+
+    def _coalesced(self, key, endpoint, fetch):
+        # identical requests sent at the same time, e.g. by several clients
+        # opening the same album, are only sent once
+        result, shared = self._in_flight.do(key, fetch)
+        if shared:
+            self.metrics.inc("coalesced_requests_total", endpoint=endpoint)
+        return result
+
+    def get_all(self, path, params=None):
+        """
+        Fetch every page of a paginated endpoint and return the results in order,
+        or None if one of the pages could not be fetched.
+        """
+        try:
+            return self._get_all(path, params)
+        except requests.RequestException as e:
+            logger.warning("Could not fetch %s: %s", path, e)
+            return None
+
+    def _get_all(self, path, params=None):
+        return list(itertools.chain.from_iterable(self._iter_pages(path, params)))
+
+    def _get_json(self, path, params=None):
+        """
+        Return the payload of ``path``, None on a 4xx response, raise on a
+        server error or when the server is still too busy after retries.
+        """
+        response = self.session.get(path, params=params)
+        if is_server_failure(response.status_code):
+            response.raise_for_status()
+        if response:
+            return decode.response_json(response)
+        return None
+
+    def iter_all(self, path, params=None):
+        """
+        Yield the items of a paginated endpoint as their page arrives.
+
+        Iteration stops early, with a warning, if a page cannot be fetched.
+        """
+        try:
+            for results in self._iter_pages(path, params):
+                yield from results
+        except requests.RequestException as e:
+            logger.warning("Could not fetch %s: %s", path, e)
+
+    def _iter_pages(self, path, params=None):
+        # The first page gives the item count, the remaining pages are then
+        # requested concurrently, at most `concurrency` of them ahead of the
+        # consumer so memory stays bounded.
+        params = dict(params or {}, page=1, page_size=self.page_size)
+        page = self.get_page(path, params)
+        results = page["results"]
+        yield results
+        if page["next"] is None or not results:
+            return
+        # the server may cap page_size, trust what it actually sent
+        params["page_size"] = len(results)
+        pages = iter(range(2, math.ceil(page["count"] / len(results)) + 1))
+        del page, results
+
+        pending = collections.deque()
+        for number in itertools.islice(pages, self.concurrency):
+            pending.append(self._submit_page(path, params, number))
+        while pending:
+            results = pending.popleft().result()["results"]
+            for number in itertools.islice(pages, 1):
+                pending.append(self._submit_page(path, params, number))
+            yield results
+
+    def submit(self, fetch, *args):
+        """Run ``fetch`` in the background, returns a future."""
+        return self._requests_executor.submit(fetch, *args)
+
+    def fetch_many(self, fetch, ids):
+        """Call ``fetch`` on each id concurrently and return a dict of id to result."""
+        ids = list(dict.fromkeys(ids))
+        if len(ids) < 2:
+            return {id: fetch(id) for id in ids}
+        return dict(zip(ids, self._requests_executor.map(fetch, ids)))
+
+    def _submit_page(self, path, params, number):
+        return self._pages_executor.submit(self.get_page, path, dict(params, page=number))
+
+    def get_page(self, path, params=None):
+        """Return one page of a paginated endpoint, raise a requests exception on failure."""
+        response = self.session.get(path, params=params)
+        response.raise_for_status()
+        return decode.response_json(response)
+
+    def _invalidate_playlists(self):
+        # playlist listings embed names and track counts, so any mutation
+        # drops every cached playlist response
+        if self.cache is not None:
+            self.cache.invalidate("playlists/")
+
+    def refresh(self, margin=None):
+        """
+        Refresh the token now, return whether it worked.
+
+        With ``margin``, the token is only refreshed if it still expires
+        within ``margin`` seconds once the lock is held, as another thread
+        may have refreshed it meanwhile.
+        """
+        oauth = self.oauth
+        with self._refresh_lock:
+            expires_at = (oauth.token or {}).get("expires_at")
+            if margin is not None and expires_at and expires_at >= time.time() + margin:
+                return True
+            try:
+                token = oauth.refresh_token(
+                    oauth.auto_refresh_url, **(oauth.auto_refresh_kwargs or {})
+                )
+            except (requests.RequestException, OAuth2Error) as e:
+                logger.warning("Could not refresh the Funkwhale token: %s", e)
+                return False
+            self.refresh_token(token)
+        return True
+
+    def refresh_token(self, token):
+        # the session already holds the new token, only persist it
+        self.metrics.inc("token_refreshes_total")
+        try:
+            set_token(token, self.config)
+        except OSError as e:
+            logger.warning("Could not save the Funkwhale token: %s", e)
+
+    def get_favorites(self):
+        return self.get_all("tracks/", {"favorites": "true", "ordering": "-creation_date"})
+
+    def get_playlists(self, id=None, fresh=False):
+        """``fresh`` skips the cached answer, the new one is cached as usual."""
+        key = f"playlists/{id or ''}"
+        if fresh and self.cache is not None:
+            self.cache.invalidate(key)
+        return self._cached(key, lambda: self._get_playlists(id))
+
+    def _get_playlists(self, id=None):
+        if id is None:
+            return self._get_all("playlists/")
+        if id:
+            return self._get_json(f"playlists/{id}")
+        return None
+
+    def get_playlists_tracks(self, id):
+        # not cached, the playlist provider keeps tracks per modification date
+        return self.get_all(f"playlists/{id}/tracks")
+
+    def get_track(self, id):
+        return self._cached(f"tracks/{id}", lambda: self._get_track(id))
+
+    def _get_track(self, id):
+        return self._get_json(f"tracks/{id}")
+
+    def get_albums(self):
+        return self.get_all("albums/", {"ordering": "title", "scope": "all"})
+
+    def get_artists(self):
+        return self.get_all("artists/", {"ordering": "name", "scope": "all"})
+
+    def iter_albums(self):
+        return self.iter_all("albums/", {"ordering": "title", "scope": "all"})
+
+    def iter_artists(self):
+        return self.iter_all("artists/", {"ordering": "name", "scope": "all"})
+
+    def get_tracks(self):
+        return self.get_all("tracks/", {"ordering": "title", "scope": "all"})
+
+    def get_album_tracks(self, id):
+        return self._cached(f"tracks/?album={id}", lambda: self._get_album_tracks(id))
+
+    def _get_album_tracks(self, id):
+        return self._get_all("tracks/", {"album": id, "ordering": "disc_number,position"})
+
+    def get_artist_tracks(self, id):
+        return self._cached(f"tracks/?artist={id}", lambda: self._get_artist_tracks(id))
+
+    def _get_artist_tracks(self, id):
+        return self._get_all("tracks/", {"artist": id, "ordering": "title"})
+
+    def get_artist_albums(self, id):
+        """
+        Return the albums of the artist ``id``, from the cached artist payload
+        when the server embeds them, from the albums listing otherwise.
+        """
+        artist = None
+        if self.cache is not None:
+            artist = self.cache.get(f"artists/{id}", count=False)
+        if artist is not None and artist.get("albums") is not None:
+            # embedded albums leave their artist out
+            summary = {key: value for key, value in artist.items() if key != "albums"}
+            return [
+                album if isinstance(album.get("artist"), dict) else dict(album, artist=summary)
+                for album in artist["albums"]
+            ]
+        return self._cached(f"albums/?artist={id}", lambda: self._get_artist_albums(id))
+
+    def _get_artist_albums(self, id):
+        return self._get_all("albums/", {"artist": id, "ordering": "title", "scope": "all"})
+
+    def get_artist(self, id):
+        return self._cached(f"artists/{id}", lambda: self._get_artist(id))
+
+    def _get_artist(self, id):
+        return self._get_json(f"artists/{id}")
+
+    def get_album(self, id):
+        return self._cached(f"albums/{id}", lambda: self._get_album(id))
+
+    def _get_album(self, id):
+        return self._get_json(f"albums/{id}")
+
+    def create_playlist(self, name):
+        response = self.session.post("playlists/", data = {"name": name})
+        self._invalidate_playlists()
+        if response:
+            return decode.response_json(response)
+
+    def update_playlist(self, id, name):
+        response = self.session.patch(f"playlists/{id}", data={"name": name})
+        self._invalidate_playlists()
+        if response:
+            return decode.response_json(response)
+
+    def delete_playlist(self, id):
+        response = self.session.delete(f"playlists/{id}")
+        self._invalidate_playlists()
+        return bool(response)
+
+    def clear_playlist(self, id):
+        response = self.session.delete(f"playlists/{id}/clear")
+        self._invalidate_playlists()
+        return bool(response)
+
+    def add_tracks_playlist(self, id, tracks):
+        response = self.session.post(f"playlists/{id}/add", data={"tracks": tracks, "allow_duplicates": True})
+        self._invalidate_playlists()
+        return bool(response)
+
+    def remove_playlist_track(self, id, index):
+        response = self.session.delete(f"playlists/{id}/remove", data={"index": index})
+        self._invalidate_playlists()
+        return bool(response)
+
+    def move_playlist_track(self, id, from_index, to_index):
+        response = self.session.post(f"playlists/{id}/move", data={"from": from_index, "to": to_index})
+        self._invalidate_playlists()
+        return bool(response)
+
+    def search(self, query):
+        response = self.session.get("search", params={"query": query})
+        if response:
+            return decode.response_json(response)
+
+
+def is_server_failure(status_code):
+    # a 429 left after retries means the server is overloaded, not that the
+    # request was wrong
+    return status_code >= 500 or status_code == 429
+
+
+def is_client_error(error):
+    response = getattr(error, "response", None)
+    return (
+        response is not None
+        and 400 <= response.status_code < 500
+        and not is_server_failure(response.status_code)
+    )
+
+
+def get_token_path(config):
+    """Return the token file of the server ``config`` is about, see ``servers``."""
+    import mopidy_funkwhale
+
+    data_dir = mopidy_funkwhale.Extension.get_data_dir(config)
+    server = config["funkwhale"].get("server")
+    return os.path.join(data_dir, f"token-{server}" if server else "token")
+
+
+def get_token(config):
+    try:
+        with open(get_token_path(config), "r") as f:
+            raw = f.read()
+    except IOError:
+        return None
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        logger.error("Cannot decode token data, you may need to relogin")
+
+
+def set_token(token_data, config):
+    content = json.dumps(token_data)
+    path = get_token_path(config)
+    # write then rename, a crash never leaves a truncated token behind
+    tmp = path + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    os.replace(tmp, path)
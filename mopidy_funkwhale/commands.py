@@ -1,8 +1,6 @@
 from mopidy import commands, exceptions
 
-import requests_oauthlib
-
-from . import backend as client
+from . import metrics
 
 
 def urlencode(data):
@@ -21,6 +19,7 @@ class FunkwhaleCommand(commands.Command):
     def __init__(self):
         super(FunkwhaleCommand, self).__init__()
         self.add_child("login", LoginCommand())
+        self.add_child("stats", StatsCommand())
 
 
 class LoginCommand(commands.Command):
@@ -28,9 +27,23 @@ class LoginCommand(commands.Command):
         "Display authorization URL and instructions to connect with Funkwhale server."
     )
 
+    def __init__(self):
+        super(LoginCommand, self).__init__()
+        self.add_argument(
+            "--server",
+            help="Name of the server to log into, from the servers setting. "
+            "Defaults to the main server.",
+        )
+
     def run(self, args, config):
-        import mopidy_funkwhale
+        import requests_oauthlib
 
+        from . import client, servers
+
+        config = servers.get_server_config(config, args.server)
+        if config is None:
+            print("No server named {} in the servers setting.".format(args.server))
+            return 1
         url = config["funkwhale"]["url"]
         authorize_endpoint = (
             config["funkwhale"].get("authorize_endpoint") or "/authorize"
@@ -52,9 +65,13 @@ class LoginCommand(commands.Command):
                 "1. Create an app by visiting {}"
                 "\n2. Ensure the created app has 'urn:ietf:wg:oauth:2.0:oob' as "
                 "redirect URI, and the following scopes: {}"
-                "\n3. Update the client_id and client_secret values in the [funkwhale] section of your mopidy configuration, to match the values of the created application"
+                "\n3. Update the client_id and client_secret values {} of your mopidy configuration, to match the values of the created application"
                 "\n4. Relaunch this command".format(
-                    app_url, ", ".join(client.REQUIRED_SCOPES)
+                    app_url,
+                    ", ".join(client.REQUIRED_SCOPES),
+                    "of the {} entry in servers".format(args.server)
+                    if args.server
+                    else "in the [funkwhale] section",
                 )
             )
             return 1
@@ -87,3 +104,20 @@ class LoginCommand(commands.Command):
         client.set_token(token, config)
         print("Login successful!")
         return 0
+
+
+class StatsCommand(commands.Command):
+    help = "Display the request metrics of the running Funkwhale backend."
+
+    def run(self, args, config):
+        path = metrics.get_metrics_path(config)
+        try:
+            with open(path) as f:
+                print(f.read(), end="")
+        except FileNotFoundError:
+            print(
+                "No metrics found in {}. Start mopidy with metrics_interval set "
+                "in the [funkwhale] section and try again.".format(path)
+            )
+            return 1
+        return 0
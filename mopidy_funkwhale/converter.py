@@ -1,49 +1,43 @@
 from mopidy import models
-from . import uri
-
-def json_to_track_ref(json):
-    return models.Ref.track(uri=uri.get_track_uri(json["id"]), name=json["title"])
-
-def json_to_track(json):
-    if len(json["uploads"]):
-        upload = json["uploads"][0]
-    else:
-        upload = {"duration": 0, "bitrate": 0}
-    return models.Track(
-        uri = uri.get_track_uri(json["id"]),
-        name = json["title"],
-        artists = [json_to_artist(json["artist"])],
-        album = json_to_album(json["album"]),
-        composers = [],
-        performers = [],
-        genre = str(json["tags"]),
-        track_no = json.get("position"),
-        disc_no = json.get("disc_number"),
-        date = json["album"]["release_date"],
-        length = upload.get("duration", 0)*1000,
-        bitrate = int(upload.get("bitrate", 0)/1000),
-        comment = "",
-        musicbrainz_id = json["mbid"]
-    )
+from . import records, uri
 
-def json_to_album(json):
-    return models.Album(
-        uri = uri.get_album_uri(json["id"]),
-        name = json["title"],
-        artists = [json_to_artist(json["artist"]), ],
-        num_tracks = None,
-        num_discs = None,
-        date = json["release_date"],
-        musicbrainz_id = json["mbid"],
-    )
+# Every function accepts an optional cache.ModelCache, the records they build
+# are added to it so they can be reused without asking the server again.
+# Refs only need the record, full models are built from it on demand.
+# URIs name the server of the cache, if it isn't the main one.
 
-def json_to_artist(json):
-    return models.Artist(
-        uri = uri.get_artist_uri(json["id"]),
-        name = json["name"],
-        sortname = json["name"],
-        musicbrainz_id = json["mbid"],
-    )
+def get_server(cache):
+    return cache.server if cache is not None else None
+
+def json_to_track_ref(json, cache=None):
+    if cache is not None:
+        cache.add_track(json)
+    return models.Ref.track(uri=uri.get_track_uri(json["id"], get_server(cache)), name=json["title"])
+
+def json_to_album_ref(json, cache=None):
+    if cache is not None:
+        cache.add_album(json)
+    return models.Ref.album(uri=uri.get_album_uri(json["id"], get_server(cache)), name=json["title"])
+
+def json_to_artist_ref(json, cache=None):
+    if cache is not None:
+        cache.add_artist(json)
+    return models.Ref.artist(uri=uri.get_artist_uri(json["id"], get_server(cache)), name=json["name"])
+
+def json_to_track(json, cache=None):
+    if cache is not None:
+        return cache.add_track(json).to_model()
+    return records.TrackRecord.from_json(json).to_model()
+
+def json_to_album(json, cache=None):
+    if cache is not None:
+        return cache.add_album(json).to_model()
+    return records.AlbumRecord.from_json(json).to_model()
+
+def json_to_artist(json, cache=None):
+    if cache is not None:
+        return cache.add_artist(json).to_model()
+    return records.ArtistRecord.from_json(json).to_model()
 
 
 def json_to_image(json):
@@ -51,4 +45,12 @@ def json_to_image(json):
         uri=json
     )
 
+def json_to_images(json):
+    # tracks without a cover of their own use the album one
+    cover = json.get("cover") or (json.get("album") or {}).get("cover")
+    url = ((cover or {}).get("urls") or {}).get("original")
+    if url:
+        return [json_to_image(url)]
+    return []
+
 
@@ -0,0 +1,125 @@
+"""
+Decoding of API responses.
+
+Responses are parsed once, with orjson when it is installed, then reduced
+to the fields the converters, the library index and the search index
+read. The API has no way to ask for fewer fields, so the pruning happens
+here, before payloads reach the caches.
+"""
+import json
+
+from .metrics import get_endpoint
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def response_json(response):
+    """Return the decoded payload of ``response``, pruned according to its endpoint."""
+    payload = loads(response.content)
+    slim = SLIMMERS.get(get_endpoint(response.url))
+    if slim is not None and payload is not None:
+        payload = slim(payload)
+    return payload
+
+
+def pick(json, fields):
+    return {field: json[field] for field in fields if field in json}
+
+
+def slim_cover(json):
+    if not json:
+        return None
+    return {"urls": {"original": (json.get("urls") or {}).get("original")}}
+
+
+def slim_upload(json):
+    return pick(json, UPLOAD_FIELDS)
+
+
+def slim_artist(json):
+    if not json:
+        return json
+    artist = pick(json, ARTIST_FIELDS)
+    if "cover" in json:
+        artist["cover"] = slim_cover(json["cover"])
+    if json.get("albums") is not None:
+        artist["albums"] = [slim_album(album) for album in json["albums"]]
+    return artist
+
+
+def slim_album(json):
+    if not json:
+        return json
+    album = pick(json, ALBUM_FIELDS)
+    if isinstance(json.get("artist"), dict):
+        album["artist"] = slim_artist(json["artist"])
+    if "cover" in json:
+        album["cover"] = slim_cover(json["cover"])
+    return album
+
+
+def slim_track(json):
+    if not json:
+        return json
+    track = pick(json, TRACK_FIELDS)
+    track["artist"] = slim_artist(json.get("artist"))
+    track["album"] = slim_album(json.get("album"))
+    track["uploads"] = [slim_upload(upload) for upload in json.get("uploads") or []]
+    if "cover" in json:
+        track["cover"] = slim_cover(json["cover"])
+    return track
+
+
+def slim_playlist_track(json):
+    return {"index": json.get("index"), "track": slim_track(json["track"])}
+
+
+def slim_page(slim):
+    def slim_results(json):
+        return dict(json, results=[slim(item) for item in json["results"]])
+
+    return slim_results
+
+
+def slim_search(json):
+    return {
+        "artists": [slim_artist(artist) for artist in json.get("artists", [])],
+        "albums": [slim_album(album) for album in json.get("albums", [])],
+        "tracks": [slim_track(track) for track in json.get("tracks", [])],
+    }
+
+
+ARTIST_FIELDS = ("id", "name", "mbid", "creation_date")
+ALBUM_FIELDS = ("id", "title", "mbid", "release_date", "creation_date", "tracks_count")
+TRACK_FIELDS = (
+    "id",
+    "title",
+    "mbid",
+    "position",
+    "disc_number",
+    "tags",
+    "listen_url",
+    "creation_date",
+)
+UPLOAD_FIELDS = ("uuid", "duration", "bitrate", "size", "extension", "mimetype", "listen_url")
+
+# logical endpoint, as returned by metrics.get_endpoint, to pruning function
+SLIMMERS = {
+    "artists": slim_page(slim_artist),
+    "artists/{id}": slim_artist,
+    "albums": slim_page(slim_album),
+    "albums/{id}": slim_album,
+    "tracks": slim_page(slim_track),
+    "tracks/{id}": slim_track,
+    "playlists/{id}/tracks": slim_page(slim_playlist_track),
+    "search": slim_search,
+}
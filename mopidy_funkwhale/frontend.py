@@ -0,0 +1,69 @@
+import logging
+
+import pykka
+
+from mopidy import core
+
+from . import uri
+
+
+logger = logging.getLogger(__name__)
+
+
+class FunkwhaleFrontend(pykka.ThreadingActor, core.CoreListener):
+    """
+    Tell the backend which Funkwhale tracks are due to play next.
+
+    Only the core knows the tracklist and its play order, so the upcoming
+    tracks are sent from here whenever playback, the tracklist or its
+    options change, and the backend prefetches their stream URLs, or their
+    audio when the audio cache is enabled.
+    """
+
+    def __init__(self, config, core):
+        super().__init__()
+        self.core = core
+        self.prefetch_count = config["funkwhale"].get("prefetch_count")
+        if self.prefetch_count is None:
+            self.prefetch_count = 2
+
+    def track_playback_started(self, tl_track):
+        self._prefetch(tl_track)
+
+    def tracklist_changed(self):
+        self._prefetch(self.core.playback.get_current_tl_track().get())
+
+    def options_changed(self):
+        self.tracklist_changed()
+
+    def _prefetch(self, tl_track):
+        if not self.prefetch_count or tl_track is None:
+            return
+        upcoming = self._get_upcoming(tl_track)[:self.prefetch_count]
+        p_uris = [t.track.uri for t in upcoming if t.track.uri.startswith(f"{uri.PREFIX}:")]
+        if not p_uris:
+            return
+        from .backend import FunkwhaleBackend
+
+        for ref in pykka.ActorRegistry.get_by_class(FunkwhaleBackend):
+            ref.proxy().playback.prefetch(p_uris)
+
+    def _get_upcoming(self, tl_track):
+        tracklist = self.core.tracklist
+        if tracklist.get_single().get():
+            return []
+        if tracklist.get_random().get():
+            # the shuffled order is private to the core, only the next
+            # track is known
+            tlid = tracklist.get_eot_tlid().get()
+            if tlid is None:
+                return []
+            return tracklist.filter({"tlid": [tlid]}).get()
+        tl_tracks = tracklist.get_tl_tracks().get()
+        index = tracklist.index(tl_track).get()
+        if index is None:
+            return []
+        upcoming = tl_tracks[index + 1:]
+        if tracklist.get_repeat().get():
+            upcoming += tl_tracks[:index]
+        return upcoming
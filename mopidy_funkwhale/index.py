@@ -0,0 +1,270 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS artists (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    json TEXT NOT NULL,
+    seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS albums (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    artist_id INTEGER,
+    json TEXT NOT NULL,
+    seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tracks (
+    id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    album_id INTEGER,
+    artist_id INTEGER,
+    disc_number INTEGER,
+    position INTEGER,
+    json TEXT NOT NULL,
+    seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS albums_title ON albums (title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS albums_artist ON albums (artist_id, title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS artists_name ON artists (name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album_id, disc_number, position);
+CREATE INDEX IF NOT EXISTS tracks_artist ON tracks (artist_id, title COLLATE NOCASE);
+"""
+
+
+class LibraryIndex:
+    """
+    Local SQLite copy of the server catalogue, filled by sync.LibrarySync.
+
+    The index is readable as soon as it has been filled once, syncs
+    replace rows in place so browsing keeps working while they run.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ready = False
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    @classmethod
+    def from_config(cls, config):
+        import mopidy_funkwhale
+
+        data_dir = mopidy_funkwhale.Extension.get_data_dir(config)
+        return cls(os.path.join(data_dir, "library.sqlite3"))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def get_meta(self, key):
+        rows = self._query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def set_meta(self, key, value):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+            )
+            self._db.commit()
+
+    @property
+    def ready(self):
+        if not self._ready:
+            self._ready = self.get_meta("synced_at") is not None
+        return self._ready
+
+    def add_artists(self, artists, seen):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO artists (id, name, json, seen) VALUES (?, ?, ?, ?)",
+                [(a["id"], a["name"], json.dumps(a), seen) for a in artists],
+            )
+            self._db.commit()
+
+    def add_albums(self, albums, seen):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO albums (id, title, artist_id, json, seen) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (a["id"], a["title"], a["artist"]["id"], json.dumps(a), seen)
+                    for a in albums
+                ],
+            )
+            self._db.commit()
+
+    def add_tracks(self, tracks, seen):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO tracks (id, title, album_id, artist_id, disc_number, position, json, seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        t["id"],
+                        t["title"],
+                        (t.get("album") or {}).get("id"),
+                        t["artist"]["id"],
+                        t.get("disc_number"),
+                        t.get("position"),
+                        json.dumps(t),
+                        seen,
+                    )
+                    for t in tracks
+                ],
+            )
+            self._db.commit()
+
+    def prune(self, table, seen):
+        """Drop rows of ``table`` that were not seen by the refresh started at ``seen``."""
+        assert table in ("artists", "albums", "tracks")
+        with self._lock:
+            self._db.execute(f"DELETE FROM {table} WHERE seen < ?", (seen,))
+            self._db.commit()
+
+    def get_artists(self):
+        return [
+            json.loads(row[0])
+            for row in self._query("SELECT json FROM artists ORDER BY name COLLATE NOCASE")
+        ]
+
+    def get_albums(self):
+        return [
+            json.loads(row[0])
+            for row in self._query("SELECT json FROM albums ORDER BY title COLLATE NOCASE")
+        ]
+
+    def _iter_json(self, table, column=None, chunk_size=500):
+        """
+        Yield the JSON of the ``table`` rows, sorted by ``column`` without
+        case then id, or by id alone.
+        """
+        # read in chunks so the lock is not held while the caller consumes
+        # rows, each chunk starts after the last row of the previous one:
+        # an OFFSET would scan all the rows before it again
+        if column is None:
+            select = f"SELECT json, id FROM {table}"
+            after = "WHERE id > ?"
+            order = "ORDER BY id"
+        else:
+            select = f"SELECT json, id, {column} FROM {table}"
+            after = f"WHERE ({column} COLLATE NOCASE, id) > (?, ?)"
+            order = f"ORDER BY {column} COLLATE NOCASE, id"
+        rows = self._query(f"{select} {order} LIMIT ?", (chunk_size,))
+        while True:
+            for row in rows:
+                yield json.loads(row[0])
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1]
+            key = (last[1],) if column is None else (last[2], last[1])
+            rows = self._query(f"{select} {after} {order} LIMIT ?", key + (chunk_size,))
+
+    def iter_artists(self):
+        return self._iter_json("artists", "name")
+
+    def iter_albums(self):
+        return self._iter_json("albums", "title")
+
+    def iter_tracks(self):
+        return self._iter_json("tracks")
+
+    def get_many(self, table, ids):
+        """Return the JSON of the ``table`` rows with the given ids, in the same order."""
+        assert table in ("artists", "albums", "tracks")
+        if not ids:
+            return []
+        rows = self._query(
+            f"SELECT id, json FROM {table} WHERE id IN ({', '.join('?' * len(ids))})",
+            list(ids),
+        )
+        found = {id: json.loads(raw) for id, raw in rows}
+        return [found[id] for id in ids if id in found]
+
+    def get_artist(self, id):
+        rows = self._query("SELECT json FROM artists WHERE id = ?", (id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_album(self, id):
+        rows = self._query("SELECT json FROM albums WHERE id = ?", (id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_track(self, id):
+        rows = self._query("SELECT json FROM tracks WHERE id = ?", (id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def _get_children(self, sql, id):
+        # nothing may only mean the items are not synced yet, None lets the
+        # caller ask the server
+        rows = self._query(sql, (id,))
+        return [json.loads(row[0]) for row in rows] or None
+
+    def get_album_tracks(self, id):
+        return self._get_children(
+            "SELECT json FROM tracks WHERE album_id = ? ORDER BY disc_number, position", id
+        )
+
+    def get_artist_albums(self, id):
+        return self._get_children(
+            "SELECT json FROM albums WHERE artist_id = ? ORDER BY title COLLATE NOCASE", id
+        )
+
+    def get_artist_tracks(self, id):
+        return self._get_children(
+            "SELECT json FROM tracks WHERE artist_id = ? ORDER BY title COLLATE NOCASE", id
+        )
+
+    def set_favorites(self, ids):
+        self.set_meta("favorites", json.dumps(ids))
+
+    def get_favorites(self):
+        return self.get_many("tracks", json.loads(self.get_meta("favorites") or "[]"))
+
+    def search(self, query, limit=50):
+        """
+        Return artists, albums and tracks matching every word of ``query``,
+        in the same shape as the server ``search`` endpoint. Like the
+        server, albums also match on their artist name, and tracks on
+        their artist name and album title.
+        """
+        words = query.split()
+        if not words:
+            return {"artists": [], "albums": [], "tracks": []}
+
+        def match(table, columns):
+            # every word must be found in one of the columns
+            where = " AND ".join(
+                "(" + " OR ".join(f"{column} LIKE ?" for column in columns) + ")"
+                for _ in words
+            )
+            return [
+                json.loads(row[0])
+                for row in self._query(
+                    f"SELECT json FROM {table} WHERE {where} LIMIT ?",
+                    [f"%{w}%" for w in words for _ in columns] + [limit],
+                )
+            ]
+
+        artist_name = "json_extract(json, '$.artist.name')"
+        album_title = "json_extract(json, '$.album.title')"
+        return {
+            "artists": match("artists", ["name"]),
+            "albums": match("albums", ["title", artist_name]),
+            "tracks": match("tracks", ["title", artist_name, album_title]),
+        }
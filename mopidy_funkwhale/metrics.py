@@ -0,0 +1,143 @@
+import collections
+import contextlib
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+
+
+logger = logging.getLogger(__name__)
+
+# upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ID_RE = re.compile(r"^(\d+|[0-9a-f-]{36})$")
+
+
+def get_endpoint(url):
+    """
+    Return the logical endpoint of an API URL or path.
+
+    ``https://host/api/v1/tracks/42?page=2`` and ``tracks/43`` are both ``tracks/{id}``.
+    """
+    path = urllib.parse.urlsplit(url).path
+    path = path.split("/api/v1/", 1)[-1]
+    parts = [part for part in path.split("/") if part]
+    return "/".join("{id}" if ID_RE.match(part) else part for part in parts) or "/"
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+
+
+class Metrics:
+    """
+    Counters and latency histograms, labelled by endpoint, rendered in the
+    Prometheus text format.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+        self._histograms = collections.defaultdict(Histogram)
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[name, tuple(sorted(labels.items()))] += value
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            self._histograms[name, tuple(sorted(labels.items()))].observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def get(self, name, **labels):
+        return self._counters[name, tuple(sorted(labels.items()))]
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                (key, (list(h.buckets), h.sum, h.count)) for key, h in self._histograms.items()
+            )
+        declared = set()
+        for (name, labels), value in counters:
+            if name not in declared:
+                lines.append(f"# TYPE funkwhale_{name} counter")
+                declared.add(name)
+            lines.append(f"funkwhale_{name}{format_labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in declared:
+                lines.append(f"# TYPE funkwhale_{name} histogram")
+                declared.add(name)
+            for bound, bucket in zip(BUCKETS, buckets):
+                lines.append(
+                    f"funkwhale_{name}_bucket{format_labels(labels + (('le', bound),))} {bucket}"
+                )
+            lines.append(f"funkwhale_{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"funkwhale_{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"funkwhale_{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # write then rename, readers never see a partial file
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.render())
+        os.replace(tmp, path)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def get_metrics_path(config):
+    import mopidy_funkwhale
+
+    return os.path.join(mopidy_funkwhale.Extension.get_data_dir(config), "metrics.prom")
+
+
+class Exporter(threading.Thread):
+    """Write the metrics to ``path`` every ``interval`` seconds, for ``mopidy funkwhale stats``."""
+
+    def __init__(self, metrics, path, interval):
+        super().__init__(name="FunkwhaleMetrics", daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+        self._write()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._write()
+
+    def _write(self):
+        try:
+            self.metrics.write(self.path)
+        except OSError as e:
+            logger.warning("Could not write Funkwhale metrics to %s: %s", self.path, e)
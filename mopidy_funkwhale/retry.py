@@ -0,0 +1,167 @@
+"""
+Retries and circuit breaking for API requests.
+
+Idempotent requests failing with a connection error, a timeout or a 5xx
+response are retried a few times with jittered exponential backoff. 429
+responses are retried for every method, after the delay the server asks
+for. When an endpoint keeps failing, its circuit breaker opens and its
+requests fail immediately with ``CircuitOpenError`` until it is probed
+again, which lets callers fall back to stale cached data instead of piling
+up blocked threads. Each endpoint has its own breaker, so a query the
+server chokes on doesn't cut off playback or token refreshes, and a
+request only counts as one failure however many times it was retried.
+"""
+import logging
+import random
+import threading
+import time
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# first backoff delay and upper bound, in seconds
+BACKOFF = 0.5
+MAX_BACKOFF = 8
+# seconds a request may spend waiting for Retry-After delays in total,
+# beyond that the 429 response is returned. Requests run on behalf of the
+# backend actor, which must keep responding
+MAX_RETRY_AFTER = 5
+
+# consecutive failed requests opening the circuit, and seconds before it is probed
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """The server failed too many times in a row, the request was not sent."""
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Raise ``CircuitOpenError`` if the request must not be sent."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                # let a single request through to probe the server, another
+                # one after reset_timeout if this one never reports back
+                self.state = self.HALF_OPEN
+                self._opened_at = now
+                return
+            raise CircuitOpenError("Funkwhale endpoint unavailable, not sending the request")
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Funkwhale endpoint is back")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.threshold
+            ):
+                if self.state == self.CLOSED:
+                    logger.warning(
+                        "Funkwhale endpoint failed %d times in a row, pausing its requests for %ds",
+                        self.failures,
+                        self.reset_timeout,
+                    )
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+def get_backoff(attempt):
+    """Return the delay before retry number ``attempt`` (from 0), with full jitter."""
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2 ** attempt))
+
+
+def get_retry_after(response):
+    """Return the delay asked by a ``Retry-After`` header in seconds, None if absent or a date."""
+    value = response.headers.get("Retry-After")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class Retry:
+    """Send requests through ``call``, retrying them and tracking failures per endpoint."""
+
+    def __init__(
+        self, retries=2, metrics=None, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT
+    ):
+        self.retries = retries
+        self.metrics = metrics
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get_breaker(self, endpoint):
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(
+                    self.threshold, self.reset_timeout
+                )
+            return breaker
+
+    def call(self, method, endpoint, send):
+        breaker = self.get_breaker(endpoint)
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        attempt = 0
+        waited = 0
+        while True:
+            breaker.check()
+            # a probe of an open circuit gets a single attempt
+            last = not idempotent or attempt >= self.retries or breaker.state == breaker.HALF_OPEN
+            try:
+                response = send()
+            except (requests.ConnectionError, requests.Timeout):
+                if last:
+                    breaker.record_failure()
+                    raise
+                delay = get_backoff(attempt)
+            else:
+                if response.status_code == 429:
+                    # the server is up, only asking us to slow down
+                    breaker.record_success()
+                    delay = get_retry_after(response)
+                    if delay is None:
+                        delay = get_backoff(attempt)
+                    if attempt >= self.retries or waited + delay > MAX_RETRY_AFTER:
+                        return response
+                    waited += delay
+                elif response.status_code >= 500:
+                    if last:
+                        breaker.record_failure()
+                        return response
+                    delay = get_backoff(attempt)
+                else:
+                    breaker.record_success()
+                    return response
+            attempt += 1
+            if self.metrics is not None:
+                self.metrics.inc("http_retries_total", endpoint=endpoint, method=method)
+            logger.debug("Retrying %s %s in %.1fs", method, endpoint, delay)
+            time.sleep(delay)
@@ -0,0 +1,199 @@
+import bisect
+import collections
+import logging
+import re
+import time
+import unicodedata
+
+from . import uri
+
+
+logger = logging.getLogger(__name__)
+
+# mopidy search fields each kind of result can match
+FIELDS = {
+    "tracks": ("track_name", "artist", "albumartist", "album", "date", "genre"),
+    "albums": ("album", "artist", "albumartist", "date"),
+    "artists": ("artist",),
+}
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def normalize(value):
+    """Lower case ``value`` and strip its accents."""
+    value = unicodedata.normalize("NFKD", str(value))
+    return "".join(c for c in value if not unicodedata.combining(c)).casefold().strip()
+
+
+def tokenize(value):
+    return TOKEN_RE.findall(normalize(value))
+
+
+def track_fields(json):
+    album = json.get("album") or {}
+    return {
+        "track_name": [json["title"]],
+        "artist": [json["artist"]["name"]],
+        "albumartist": [album["artist"]["name"]] if album.get("artist") else [],
+        "album": [album["title"]] if album else [],
+        "date": [album["release_date"]] if album.get("release_date") else [],
+        "genre": [tag for tag in json.get("tags") or [] if isinstance(tag, str)],
+    }
+
+
+def album_fields(json):
+    return {
+        "album": [json["title"]],
+        "artist": [json["artist"]["name"]],
+        "albumartist": [json["artist"]["name"]],
+        "date": [json["release_date"]] if json.get("release_date") else [],
+    }
+
+
+def artist_fields(json):
+    return {"artist": [json["name"]]}
+
+
+class SearchIndex:
+    """
+    In-memory inverted index over the library index content.
+
+    Each indexed word points to the ids of the artists, albums and tracks
+    whose field contains it. Plain queries match words by prefix, so
+    partial words typed by search-as-you-type clients already match,
+    exact queries compare whole field values.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._postings = {}
+        self._vocabulary = {}
+        self._values = {}
+        self._parents = {}
+
+    def build(self, library_index, stopped=None):
+        """
+        Index the content of ``library_index``. The build is abandoned, the
+        previous content kept, as soon as the ``stopped`` callable returns true.
+        """
+        started = time.monotonic()
+        postings = {kind: collections.defaultdict(lambda: collections.defaultdict(set)) for kind in FIELDS}
+        values = {kind: collections.defaultdict(lambda: collections.defaultdict(set)) for kind in FIELDS}
+        parents = {kind: {} for kind in FIELDS}
+
+        def add(kind, id, fields, parent_uris):
+            parents[kind][id] = parent_uris
+            for field, field_values in fields.items():
+                for value in field_values:
+                    values[kind][field][normalize(value)].add(id)
+                    for token in tokenize(value):
+                        postings[kind][field][token].add(id)
+
+        def is_stopped():
+            if stopped is not None and stopped():
+                logger.debug("Funkwhale search index build stopped")
+                return True
+            return False
+
+        for json in library_index.iter_artists():
+            if is_stopped():
+                return
+            add("artists", json["id"], artist_fields(json), ())
+        for json in library_index.iter_albums():
+            if is_stopped():
+                return
+            add(
+                "albums",
+                json["id"],
+                album_fields(json),
+                (uri.get_artist_uri(json["artist"]["id"]),),
+            )
+        for json in library_index.iter_tracks():
+            if is_stopped():
+                return
+            album = json.get("album") or {}
+            parent_uris = [uri.get_artist_uri(json["artist"]["id"])]
+            if album:
+                parent_uris.append(uri.get_album_uri(album["id"]))
+                if album.get("artist"):
+                    parent_uris.append(uri.get_artist_uri(album["artist"]["id"]))
+            add("tracks", json["id"], track_fields(json), tuple(parent_uris))
+
+        self._postings = postings
+        self._values = values
+        self._parents = parents
+        self._vocabulary = {
+            kind: {field: sorted(tokens) for field, tokens in fields.items()}
+            for kind, fields in postings.items()
+        }
+        self.ready = True
+        logger.info(
+            "Funkwhale search index built in %.1fs (%d tracks)",
+            time.monotonic() - started,
+            len(parents["tracks"]),
+        )
+
+    def search(self, query, uris=None, exact=False, limit=100):
+        """
+        Return the ids of the matching artists, albums and tracks.
+
+        ``query`` is a mopidy search query, a dict of field to list of values.
+        Results are restricted to the items under ``uris`` when given.
+        """
+        results = {}
+        for kind, kind_fields in FIELDS.items():
+            if any(field not in kind_fields + ("any",) for field in query):
+                # this kind of result has no such field
+                results[kind] = []
+                continue
+            ids = None
+            for field, field_values in query.items():
+                fields = kind_fields if field == "any" else (field,)
+                if isinstance(field_values, str):
+                    field_values = [field_values]
+                for value in field_values:
+                    matches = self._match(kind, fields, value, exact)
+                    ids = matches if ids is None else ids & matches
+            ids = sorted(self._filter_uris(kind, ids or set(), uris))
+            results[kind] = ids[:limit]
+        return results
+
+    def _match(self, kind, fields, value, exact):
+        matches = set()
+        if exact:
+            for field in fields:
+                matches |= self._values[kind].get(field, {}).get(normalize(value), set())
+            return matches
+        tokens = tokenize(value)
+        if not tokens:
+            return matches
+        for field in fields:
+            field_matches = None
+            for token in tokens:
+                token_matches = self._prefix(kind, field, token)
+                field_matches = token_matches if field_matches is None else field_matches & token_matches
+            matches |= field_matches
+        return matches
+
+    def _prefix(self, kind, field, token):
+        vocabulary = self._vocabulary[kind].get(field, [])
+        postings = self._postings[kind].get(field, {})
+        matches = set()
+        position = bisect.bisect_left(vocabulary, token)
+        while position < len(vocabulary) and vocabulary[position].startswith(token):
+            matches |= postings[vocabulary[position]]
+            position += 1
+        return matches
+
+    def _filter_uris(self, kind, ids, uris):
+        if not uris or uri.get_path_uri("/") in uris:
+            return ids
+        uris = set(uris)
+        type = {"tracks": uri.TRACK, "albums": uri.ALBUM, "artists": uri.ARTIST}[kind]
+        return {
+            id
+            for id in ids
+            if uri.get_uri(type, id) in uris
+            or any(parent in uris for parent in self._parents[kind].get(id, ()))
+        }
@@ -0,0 +1,107 @@
+"""
+Funkwhale servers the library is made of.
+
+``url``, ``client_id`` and ``client_secret`` describe the main server,
+``servers`` adds others, one ``name url [client_id client_secret]`` entry
+each. Every server has its own session, token and model cache. Entries of
+the other servers carry the server name in their URIs, as in
+``funkwhale:track:12@name``, so lookups and playback go straight to the
+server they come from, while the URIs of the main server are unchanged.
+"""
+import logging
+import threading
+
+from . import cache, streams
+
+
+logger = logging.getLogger(__name__)
+
+INVALID_NAME_CHARACTERS = set(":@/ ")
+
+
+def parse_servers(config):
+    """Return the ``(name, url, client_id, client_secret)`` of the ``servers`` entries."""
+    servers = []
+    for entry in config["funkwhale"].get("servers") or []:
+        fields = entry.split()
+        if not fields:
+            continue
+        if len(fields) not in (2, 4) or INVALID_NAME_CHARACTERS & set(fields[0]):
+            logger.warning(
+                "Ignoring invalid Funkwhale server %r, expected: name url [client_id client_secret]",
+                entry,
+            )
+            continue
+        name, url, client_id, client_secret = (fields + [None, None])[:4]
+        servers.append((name, url.rstrip("/"), client_id, client_secret))
+    return servers
+
+
+def get_server_config(config, name=None):
+    """
+    Return ``config`` as seen by the client of the server ``name``, the main
+    server for None, or None if there is no such server.
+    """
+    if name is None:
+        return config
+    for server in parse_servers(config):
+        if server[0] == name:
+            return make_server_config(config, *server)
+    return None
+
+
+def make_server_config(config, name, url, client_id, client_secret):
+    section = dict(
+        config["funkwhale"],
+        url=url,
+        client_id=client_id,
+        client_secret=client_secret,
+        server=name,
+    )
+    return dict(config, funkwhale=section)
+
+
+class Server:
+    """One Funkwhale server, its client is built on first use."""
+
+    def __init__(self, name, config, metrics):
+        self.name = name
+        self.config = config
+        self.metrics = metrics
+        self.url = config["funkwhale"]["url"]
+        self.model_cache = cache.ModelCache(
+            maxsize=config["funkwhale"].get("model_cache_size") or 10000,
+            stream_policy=streams.StreamPolicy.from_config(config),
+            server=name,
+        )
+        self._client = None
+        self._client_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<Server {self.name or 'main'} {self.url}>"
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    from .client import APIClient
+
+                    self._client = APIClient(self.config, self.metrics)
+        return self._client
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+
+def from_config(config, metrics):
+    """Return the servers by name, the main one first under None."""
+    servers = {None: Server(None, config, metrics)}
+    for server in parse_servers(config):
+        name = server[0]
+        if name in servers:
+            logger.warning("Ignoring duplicate Funkwhale server %r", name)
+            continue
+        servers[name] = Server(name, make_server_config(config, *server), metrics)
+    return servers
@@ -0,0 +1,94 @@
+"""
+Choice of the upload, and of the transcoding, used to stream a track.
+
+Funkwhale tracks may have several uploads, in different formats and
+bitrates, and the listen endpoint can transcode them: ``upload`` picks the
+file, ``to`` a format and ``max_bitrate`` (in kbps) caps the bitrate.
+"""
+import logging
+import re
+import urllib.parse
+
+
+logger = logging.getLogger(__name__)
+
+
+class StreamPolicy:
+    """Pick the upload closest to ``format`` and ``max_bitrate``, None meaning anything."""
+
+    def __init__(self, format=None, max_bitrate=None):
+        self.format = format.lower() if format else None
+        self.max_bitrate = max_bitrate or None
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Return the policy of ``stream_format`` and ``max_bitrate``, or of the
+        first ``stream_overrides`` entry matching the audio output.
+        """
+        format = config["funkwhale"].get("stream_format")
+        max_bitrate = config["funkwhale"].get("max_bitrate")
+        output = (config.get("audio") or {}).get("output") or ""
+        for override in config["funkwhale"].get("stream_overrides") or []:
+            pattern, _, value = override.partition("=")
+            if pattern.strip() and pattern.strip() in output:
+                format, _, bitrate = value.partition("/")
+                try:
+                    max_bitrate = int(bitrate) if bitrate.strip() else None
+                except ValueError:
+                    logger.warning("Ignoring invalid bitrate in stream override %r", override)
+                    max_bitrate = None
+                format = format.strip() or None
+                break
+        return cls(format, max_bitrate)
+
+    @property
+    def key(self):
+        """Name the format and bitrate streamed, safe to use in file names."""
+        format = re.sub(r"[^a-z0-9]", "_", self.format) if self.format else "any"
+        return f"{format}-{self.max_bitrate or 0}"
+
+    def select(self, uploads):
+        """Return the upload to stream among ``uploads``, None if there are none."""
+        if not uploads:
+            return None
+
+        def get_bitrate(upload):
+            return upload.get("bitrate") or 0
+
+        if self.max_bitrate:
+            fitting = [u for u in uploads if get_bitrate(u) <= self.max_bitrate * 1000]
+        else:
+            fitting = list(uploads)
+        if not fitting:
+            # everything needs transcoding, start from the smallest
+            return min(uploads, key=get_bitrate)
+        if self.format:
+            fitting = [u for u in fitting if self.matches(u)] or fitting
+        return max(fitting, key=get_bitrate)
+
+    def matches(self, upload):
+        return (upload.get("extension") or "").lower() == self.format
+
+    def get_bitrate(self, upload):
+        """Return the bitrate of ``upload`` once streamed, in bps."""
+        bitrate = upload.get("bitrate") or 0
+        if self.max_bitrate and (not bitrate or bitrate > self.max_bitrate * 1000):
+            return self.max_bitrate * 1000
+        return bitrate
+
+    def get_listen_url(self, listen_url, upload):
+        """Return ``listen_url`` with the parameters streaming ``upload`` as configured."""
+        if not listen_url:
+            return listen_url
+        params = {}
+        if upload is not None and upload.get("uuid"):
+            params["upload"] = upload["uuid"]
+        # the server only transcodes when the upload doesn't already fit
+        if self.format:
+            params["to"] = self.format
+        if self.max_bitrate:
+            params["max_bitrate"] = self.max_bitrate
+        if not params:
+            return listen_url
+        return listen_url + ("&" if "?" in listen_url else "?") + urllib.parse.urlencode(params)
@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+# delta syncs only see new items, a full sync also catches edits and
+# deletions
+FULL_SYNC_INTERVAL = 24 * 3600
+
+# seconds the backend waits for a stopped sync to finish its current step
+STOP_TIMEOUT = 5
+
+# index table, endpoint, and index method storing its items
+CATALOGUE = (
+    ("artists", "artists/", "add_artists"),
+    ("albums", "albums/", "add_albums"),
+    ("tracks", "tracks/", "add_tracks"),
+)
+
+
+class RateLimiter:
+    """Space calls to ``wait`` so they happen at most ``rate`` times per second."""
+
+    def __init__(self, rate, stop_event=None):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop_event = stop_event or threading.Event()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            self._stop_event.wait(delay)
+
+
+class LibrarySync(threading.Thread):
+    """
+    Background worker keeping the backend caches in sync with the server.
+
+    The catalogue goes to the library index, newest items first, and a
+    sync stops at the first item already seen. Favorites go to the index
+    too, and playlists whose modification date changed are downloaded so
+    their lookups only cost a metadata request. All requests are sent one
+    at a time, at most ``rate`` per second.
+    """
+
+    def __init__(self, backend, interval=None, rate=None):
+        super().__init__(name="FunkwhaleSync", daemon=True)
+        self.backend = backend
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self.limiter = RateLimiter(rate, self._stop_event)
+
+    def stop(self, timeout=None):
+        """Stop syncing, and wait up to ``timeout`` seconds for the thread to end."""
+        self._stop_event.set()
+        if timeout is not None and self.is_alive():
+            self.join(timeout)
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def run(self):
+        search_index = self.backend.search_index
+        if search_index is not None and self.backend.index.ready:
+            # searchable with the previous content while syncing
+            search_index.build(self.backend.index, stopped=lambda: self.stopped)
+        while not self.stopped:
+            try:
+                self.sync()
+            except Exception:
+                logger.exception("Failed to sync the Funkwhale library")
+            if not self.interval:
+                return
+            self._stop_event.wait(self.interval)
+
+    def sync(self):
+        started = time.monotonic()
+        index = self.backend.index
+        if index is not None:
+            changed = self.sync_catalogue(index)
+            if changed and self.backend.search_index is not None:
+                self.backend.search_index.build(index, stopped=lambda: self.stopped)
+            self.sync_favorites(index)
+        self.sync_playlists()
+        logger.info("Funkwhale library synced in %.1fs", time.monotonic() - started)
+
+    def sync_catalogue(self, index):
+        """Sync artists, albums and tracks into ``index``, return the number of changed items."""
+        started = time.time()
+        full_sync_at = index.get_meta("full_sync_at")
+        full = full_sync_at is None or started - float(full_sync_at) > FULL_SYNC_INTERVAL
+        complete = True
+        changed = 0
+        for table, path, add in CATALOGUE:
+            if self.stopped:
+                return changed
+            newest = None if full else index.get_meta(f"newest_{table}")
+            latest = None
+            try:
+                for results in self._iter_pages(path, {"ordering": "-creation_date", "scope": "all"}):
+                    if results and latest is None:
+                        latest = results[0].get("creation_date")
+                    if newest is not None:
+                        fresh = [item for item in results if (item.get("creation_date") or "") > newest]
+                    else:
+                        fresh = results
+                    getattr(index, add)(fresh, started)
+                    changed += len(fresh)
+                    if len(fresh) < len(results):
+                        # reached the items of the previous sync
+                        break
+            except requests.RequestException as e:
+                logger.warning("Could not sync %s: %s", table, e)
+                complete = False
+                continue
+            if self.stopped:
+                # the iteration ended early, the rows not seen yet are not
+                # gone and must not be skipped by the next delta sync
+                return changed
+            if latest is not None:
+                index.set_meta(f"newest_{table}", latest)
+            if full:
+                index.prune(table, started)
+        if complete:
+            # the index is only used once every table was synced
+            index.set_meta("synced_at", str(started))
+            if full:
+                index.set_meta("full_sync_at", str(started))
+        return changed
+
+    def sync_favorites(self, index):
+        favorites = self._get_all("tracks/", {"favorites": "true", "ordering": "-creation_date"})
+        if favorites is None:
+            return
+        index.add_tracks(favorites, time.time())
+        index.set_favorites([track["id"] for track in favorites])
+
+    def sync_playlists(self):
+        playlists = self._get_all("playlists/")
+        if playlists is None:
+            return
+        for json in playlists:
+            if self.stopped:
+                return
+            self.backend.playlists.load(json, get_tracks=self._get_playlist_tracks)
+
+    def _get_playlist_tracks(self, id):
+        return self._get_all(f"playlists/{id}/tracks")
+
+    def _get_all(self, path, params=None):
+        """Return every item of ``path``, None if a page failed or the sync was stopped."""
+        items = []
+        try:
+            for results in self._iter_pages(path, params or {}):
+                items.extend(results)
+        except requests.RequestException as e:
+            logger.warning("Could not sync %s: %s", path, e)
+            return None
+        return None if self.stopped else items
+
+    def _iter_pages(self, path, params):
+        # sequential on purpose, so the server sees a steady trickle
+        page = {"next": path}
+        params = dict(params, page_size=self.backend.client.page_size)
+        while page["next"] is not None and not self.stopped:
+            self.limiter.wait()
+            page = self.backend.client.get_page(page["next"], params)
+            # the next URL already carries the parameters
+            params = None
+            yield page["results"]
@@ -9,14 +9,20 @@ PATH = "directory"
 def get_type(uri):
     return uri.split(":")[1]
 
-def get_uri(type, id):
+# entries of servers other than the main one end with @server
+def get_uri(type, id, server=None):
+    if server:
+        return f"{PREFIX}:{type}:{id}@{server}"
     return f"{PREFIX}:{type}:{id}"
 
 def get_id(uri):
-    return uri.split(":")[2]
+    return uri.split(":")[2].partition("@")[0]
+
+def get_server(uri):
+    return uri.split(":")[2].partition("@")[2] or None
 
-def get_track_uri(track_id):
-    return get_uri(TRACK, track_id)
+def get_track_uri(track_id, server=None):
+    return get_uri(TRACK, track_id, server)
 
 def get_track_id(uri):
     return get_id(uri)
@@ -27,20 +33,20 @@ def get_playlist_uri(playlist_id):
 def get_playlist_id(uri):
     return get_id(uri)
 
-def get_album_uri(album_id):
-    return get_uri(ALBUM, album_id)
+def get_album_uri(album_id, server=None):
+    return get_uri(ALBUM, album_id, server)
 
 def get_album_id(uri):
     return get_id(uri)
 
-def get_artist_uri(artist_id):
-    return get_uri(ARTIST, artist_id)
+def get_artist_uri(artist_id, server=None):
+    return get_uri(ARTIST, artist_id, server)
 
 def get_artist_id(uri):
     return get_id(uri)
 
 def get_path(uri):
-    return get_id(uri)
+    return uri.split(":")[2]
 
 def get_path_uri(path):
     return get_uri(PATH, path)
@@ -0,0 +1,39 @@
+import pytest
+
+
+def get_artist_json(id=1):
+    return {"id": id, "name": f"Artist {id}"}
+
+
+def get_album_json(id=1, artist=1):
+    return {"id": id, "title": f"Album {id}", "artist": get_artist_json(artist)}
+
+
+def get_track_json(id=1, album=1, artist=1):
+    return {
+        "id": id,
+        "title": f"Track {id}",
+        "artist": get_artist_json(artist),
+        "album": get_album_json(album, artist),
+        "tags": [],
+        "uploads": [],
+        "listen_url": f"/api/v1/listen/{id}/",
+    }
+
+
+@pytest.fixture
+def artist_json():
+    """Return a factory of artist payloads."""
+    return get_artist_json
+
+
+@pytest.fixture
+def album_json():
+    """Return a factory of album payloads, ``artist`` being the id of their artist."""
+    return get_album_json
+
+
+@pytest.fixture
+def track_json():
+    """Return a factory of track payloads, ``album`` and ``artist`` being ids."""
+    return get_track_json
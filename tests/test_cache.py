@@ -0,0 +1,239 @@
+import threading
+import time
+
+import pytest
+
+from mopidy_funkwhale import cache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def test_get_and_set():
+    c = cache.TTLCache()
+    assert c.get("a") is None
+    assert c.get("a", "default") == "default"
+    c.set("a", 1)
+    assert c.get("a") == 1
+    assert "a" in c
+    assert len(c) == 1
+
+
+def test_entries_expire(clock):
+    c = cache.TTLCache(ttl=10)
+    c.set("a", 1)
+    clock.now += 9
+    assert c.get("a") == 1
+    clock.now += 2
+    assert c.get("a") is None
+    assert "a" not in c
+
+
+def test_expired_entries_are_returned_stale(clock):
+    c = cache.TTLCache(ttl=10)
+    c.set("a", 1)
+    clock.now += 20
+    assert c.get("a", stale=True) == 1
+
+
+def test_ttl_per_entry(clock):
+    c = cache.TTLCache(ttl=10)
+    c.set("a", 1, ttl=100)
+    clock.now += 50
+    assert c.get("a") == 1
+
+
+def test_zero_ttl_never_expires(clock):
+    c = cache.TTLCache(ttl=0)
+    c.set("a", 1)
+    clock.now += 10 ** 9
+    assert c.get("a") == 1
+
+
+def test_least_recently_used_is_evicted():
+    c = cache.TTLCache(maxsize=2)
+    c.set("a", 1)
+    c.set("b", 2)
+    c.get("a")
+    c.set("c", 3)
+    assert c.get("a") == 1
+    assert c.get("b") is None
+    assert c.get("c") == 3
+    assert len(c) == 2
+
+
+def test_invalidate_prefix():
+    c = cache.TTLCache()
+    c.set("playlists/", 1)
+    c.set("playlists/1", 2)
+    c.set("tracks/1", 3)
+    c.invalidate("playlists/")
+    assert c.get("playlists/") is None
+    assert c.get("playlists/1") is None
+    assert c.get("tracks/1") == 3
+
+
+def test_clear():
+    c = cache.TTLCache()
+    c.set("a", 1)
+    c.clear()
+    assert len(c) == 0
+
+
+def test_stats():
+    c = cache.TTLCache(maxsize=5, ttl=60)
+    c.set("a", 1)
+    c.get("a")
+    c.get("b")
+    c.get("a", count=False)
+    assert c.stats() == {"size": 1, "maxsize": 5, "ttl": 60, "hits": 1, "misses": 1}
+
+
+def test_single_flight_returns_result():
+    assert cache.SingleFlight().do("a", lambda: 1) == (1, False)
+
+
+def test_single_flight_shares_concurrent_calls():
+    flight = cache.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("a", fetch)))]
+    threads[0].start()
+    started.wait(5)
+    threads += [
+        threading.Thread(target=lambda: results.append(flight.do("a", fetch))) for _ in range(3)
+    ]
+    for thread in threads[1:]:
+        thread.start()
+    # leave the followers time to find the call in flight
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [("result", False)] + [("result", True)] * 3
+    assert len(flight) == 0
+
+
+def test_single_flight_shares_exceptions():
+    flight = cache.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fetch():
+        started.set()
+        release.wait(5)
+        raise ValueError("failed")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("a", fetch)
+        except ValueError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert len(errors) == 2
+    assert len(flight) == 0
+
+
+def test_single_flight_calls_again_once_done():
+    flight = cache.SingleFlight()
+    assert flight.do("a", lambda: 1) == (1, False)
+    assert flight.do("a", lambda: 2) == (2, False)
+
+
+def test_model_cache_get(track_json):
+    models = cache.ModelCache()
+    models.add_track(track_json())
+    track = models.get("funkwhale:track:1")
+    assert track.name == "Track 1"
+    assert track.album.uri == "funkwhale:album:1"
+    assert [artist.name for artist in track.artists] == ["Artist 1"]
+    assert models.get("funkwhale:album:1").name == "Album 1"
+    assert models.get("funkwhale:artist:1").name == "Artist 1"
+    assert models.get("funkwhale:track:2") is None
+
+
+def test_model_cache_shares_records(track_json):
+    models = cache.ModelCache()
+    first = models.add_track(track_json(1))
+    second = models.add_track(track_json(2))
+    assert first.album is second.album
+    assert first.artist is second.artist
+    assert len(models) == 4
+
+
+def test_model_cache_updates_in_place(track_json, album_json):
+    models = cache.ModelCache()
+    track = models.add_track(track_json())
+    models.add_album(
+        dict(album_json(), title="Renamed", cover={"urls": {"original": "http://cover"}})
+    )
+    assert track.album.title == "Renamed"
+    assert models.get("funkwhale:track:1").album.name == "Renamed"
+    assert [image.uri for image in models.get_images("funkwhale:album:1")] == ["http://cover"]
+    # a partial payload keeps what was known
+    models.add_album(dict(album_json(), title="Renamed"))
+    assert track.album.cover == "http://cover"
+
+
+def test_model_cache_images(track_json):
+    models = cache.ModelCache()
+    models.add_track(track_json())
+    assert models.get_images("funkwhale:track:1") == []
+    assert models.get_images("funkwhale:track:2") is None
+
+
+def test_model_cache_listen_url(track_json):
+    models = cache.ModelCache()
+    models.add_track(track_json())
+    assert models.get_listen_url("funkwhale:track:1")
+    assert models.get_listen_url("funkwhale:artist:1") is None
+    assert models.get_listen_url("funkwhale:track:2") is None
+
+
+def test_model_cache_server(track_json):
+    models = cache.ModelCache(server="other")
+    models.add_track(track_json())
+    track = models.get("funkwhale:track:1@other")
+    assert track.uri == "funkwhale:track:1@other"
+    assert track.album.uri == "funkwhale:album:1@other"
+    assert models.get("funkwhale:track:1") is None
+
+
+def test_model_cache_is_bounded(track_json):
+    models = cache.ModelCache(maxsize=3)
+    for id in range(1, 4):
+        models.add_track(track_json(id))
+    assert len(models) == 3
+    assert models.get("funkwhale:track:3") is not None
@@ -0,0 +1,144 @@
+import json
+import time
+
+import pytest
+import requests
+
+from mopidy_funkwhale import client as client_module
+
+
+class Response:
+    def __init__(self, status_code, payload=None, url="http://funkwhale.test/api/v1/"):
+        self.status_code = status_code
+        self.url = url
+        self.content = json.dumps(payload).encode()
+        self.headers = {}
+
+    def __bool__(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}", response=self)
+
+
+class Session:
+    """Answer GET requests with ``answer(path, params)``."""
+
+    def __init__(self, answer):
+        self.answer = answer
+        self.requests = []
+
+    def get(self, path, params=None):
+        self.requests.append((path, dict(params or {})))
+        return self.answer(path, params or {})
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def config(tmp_path):
+    return {
+        "funkwhale": {
+            "url": "http://funkwhale.test",
+            "client_id": None,
+            "client_secret": None,
+            "token_endpoint": "/api/v1/oauth/token/",
+            "cache_duration": 600,
+            "page_size": 2,
+            "concurrency": 2,
+        },
+        "proxy": {},
+        "core": {"data_dir": str(tmp_path), "cache_dir": str(tmp_path), "config_dir": str(tmp_path)},
+    }
+
+
+@pytest.fixture
+def api(config):
+    api = client_module.APIClient(config)
+    yield api
+    api.close()
+
+
+def expire(api):
+    for key in list(api.cache._data):
+        api.cache._data[key] = (1, api.cache._data[key][1])
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 503])
+def test_stale_copy_when_server_fails(api, track_json, status_code):
+    answers = [Response(200, track_json(1)), Response(status_code)]
+    api.session = Session(lambda path, params: answers.pop(0))
+    assert api.get_track(1)["id"] == 1
+    expire(api)
+    assert api.get_track(1)["id"] == 1
+
+
+@pytest.mark.parametrize("status_code", [403, 404])
+def test_no_stale_copy_on_client_error(api, track_json, status_code):
+    answers = [Response(200, track_json(1)), Response(status_code)]
+    api.session = Session(lambda path, params: answers.pop(0))
+    assert api.get_track(1)["id"] == 1
+    expire(api)
+    assert api.get_track(1) is None
+
+
+def test_is_client_error():
+    def error(status_code):
+        return requests.HTTPError(response=Response(status_code))
+
+    assert client_module.is_client_error(error(404))
+    assert not client_module.is_client_error(error(429))
+    assert not client_module.is_client_error(error(503))
+    assert not client_module.is_client_error(requests.ConnectionError())
+
+
+def paginated(items, page_size_cap=None, failing_page=None, delay=0):
+    """Answer pages of ``items``, slower for earlier pages so they complete out of order."""
+
+    def answer(path, params):
+        page = params.get("page", 1)
+        size = min(params["page_size"], page_size_cap or params["page_size"])
+        if page == failing_page:
+            return Response(503)
+        time.sleep(delay / page)
+        start = (page - 1) * size
+        results = items[start:start + size]
+        has_next = start + size < len(items)
+        return Response(
+            200,
+            {"count": len(items), "results": results, "next": path if has_next else None},
+        )
+
+    return answer
+
+
+@pytest.mark.parametrize("count", [0, 1, 2, 3, 9, 10])
+def test_pages_in_order(api, count):
+    items = [{"id": id} for id in range(count)]
+    api.session = Session(paginated(items, delay=0.01))
+    assert api.get_all("tracks/") == items
+    assert len(api.session.requests) == max(1, -(-count // api.page_size))
+
+
+def test_pages_follow_page_size_cap(api):
+    # the server sends fewer items per page than asked
+    items = [{"id": id} for id in range(7)]
+    api.page_size = 4
+    api.session = Session(paginated(items, page_size_cap=2))
+    assert api.get_all("tracks/") == items
+    assert [params["page_size"] for _, params in api.session.requests[1:]] == [2, 2, 2]
+
+
+def test_failed_page(api):
+    items = [{"id": id} for id in range(9)]
+    api.session = Session(paginated(items, failing_page=3))
+    assert api.get_all("tracks/") is None
+    with pytest.raises(requests.HTTPError):
+        api._get_all("tracks/")
+    # iteration yields what came before the failed page
+    assert list(api.iter_all("tracks/")) == items[:4]
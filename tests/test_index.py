@@ -0,0 +1,110 @@
+import pytest
+
+from mopidy_funkwhale import index as index_module
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "library.sqlite3")
+
+
+@pytest.fixture
+def index(path):
+    index = index_module.LibraryIndex(path)
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def filled(index, artist_json, album_json, track_json):
+    index.add_artists([artist_json(1), artist_json(2)], 1)
+    index.add_albums([album_json(1, artist=1), album_json(2, artist=2)], 1)
+    index.add_tracks(
+        [dict(track_json(id, album=1, artist=1), position=4 - id) for id in (1, 2, 3)]
+        + [track_json(4, album=2, artist=2)],
+        1,
+    )
+    return index
+
+
+def get_ids(items):
+    return [item["id"] for item in items]
+
+
+def test_ready_once_synced(index, path):
+    assert not index.ready
+    index.set_meta("synced_at", "1")
+    assert index.ready
+    index.close()
+    assert index_module.LibraryIndex(path).ready
+
+
+def test_get(filled):
+    assert filled.get_artist(1)["name"] == "Artist 1"
+    assert filled.get_album(2)["title"] == "Album 2"
+    assert filled.get_track(3)["title"] == "Track 3"
+    assert filled.get_track(10) is None
+
+
+def test_get_many_keeps_order(filled):
+    assert get_ids(filled.get_many("tracks", [3, 10, 1])) == [3, 1]
+    assert filled.get_many("tracks", []) == []
+
+
+def test_children(filled):
+    assert get_ids(filled.get_album_tracks(1)) == [3, 2, 1]
+    assert get_ids(filled.get_artist_albums(2)) == [2]
+    assert get_ids(filled.get_artist_tracks(1)) == [1, 2, 3]
+
+
+def test_no_children_is_none(filled):
+    # maybe not synced yet, the caller asks the server
+    assert filled.get_album_tracks(10) is None
+    assert filled.get_artist_albums(10) is None
+
+
+def test_replace(filled, artist_json):
+    filled.add_artists([dict(artist_json(1), name="Renamed")], 2)
+    assert filled.get_artist(1)["name"] == "Renamed"
+    assert len(list(filled.iter_artists())) == 2
+
+
+def test_prune(filled, artist_json):
+    filled.add_artists([artist_json(2)], 2)
+    filled.prune("artists", 2)
+    assert get_ids(filled.iter_artists()) == [2]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 500])
+def test_iterate_across_chunks(index, album_json, chunk_size):
+    titles = ["b", "A", "a", "C", "B", "a"]
+    index.add_albums([dict(album_json(id), title=title) for id, title in enumerate(titles, 1)], 1)
+    albums = list(index._iter_json("albums", "title", chunk_size=chunk_size))
+    # without case, then by id
+    assert get_ids(albums) == [2, 3, 6, 1, 5, 4]
+    by_id = list(index._iter_json("albums", chunk_size=chunk_size))
+    assert get_ids(by_id) == [1, 2, 3, 4, 5, 6]
+
+
+def test_iterate(filled):
+    assert get_ids(filled.iter_artists()) == [1, 2]
+    assert get_ids(filled.iter_albums()) == [1, 2]
+    assert get_ids(filled.iter_tracks()) == [1, 2, 3, 4]
+    assert get_ids(filled.get_albums()) == [1, 2]
+
+
+def test_favorites(filled):
+    assert filled.get_favorites() == []
+    filled.set_favorites([4, 1])
+    assert get_ids(filled.get_favorites()) == [4, 1]
+
+
+def test_search(filled):
+    results = filled.search("artist 2")
+    assert get_ids(results["artists"]) == [2]
+    # albums by artist name, tracks by artist name and album title
+    assert get_ids(results["albums"]) == [2]
+    # each word may match another column: "2" is also in "Track 2" by Artist 1
+    assert get_ids(results["tracks"]) == [2, 4]
+    assert get_ids(filled.search("album 1 track")["tracks"]) == [1, 2, 3]
+    assert filled.search(" ") == {"artists": [], "albums": [], "tracks": []}
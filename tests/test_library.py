@@ -0,0 +1,82 @@
+import pytest
+
+from mopidy_funkwhale import backend, servers
+
+
+class Catalogue:
+    def __init__(self, albums, artists):
+        self.albums = albums
+        self.artists = artists
+        self.listings = 0
+        self.failing = False
+
+    def get_albums(self):
+        self.listings += 1
+        return None if self.failing else self.albums
+
+    def get_artists(self):
+        self.listings += 1
+        return None if self.failing else self.artists
+
+
+class Backend:
+    def __init__(self, config, catalogue):
+        self.config = config
+        self.index = None
+        self.servers = servers.from_config(config, None)
+        self.server = self.servers[None]
+        self.server._client = catalogue
+
+    @property
+    def client(self):
+        return self.server.client
+
+    def fan_out(self, fetch, timeout=True):
+        return [fetch(server) for server in self.servers.values()]
+
+
+@pytest.fixture
+def config():
+    return {"funkwhale": {"url": "http://funkwhale.test", "browse_by_letter": True}}
+
+
+@pytest.fixture
+def catalogue(album_json, artist_json):
+    titles = ["Abba", "bach", "Éclat", "2001"]
+    albums = [dict(album_json(id), title=title) for id, title in enumerate(titles)]
+    names = ["Air", "Bach"]
+    artists = [dict(artist_json(id), name=name) for id, name in enumerate(names)]
+    return Catalogue(albums, artists)
+
+
+@pytest.fixture
+def library(config, catalogue):
+    return backend.FunkwhaleLibraryProvider(Backend(config, catalogue))
+
+
+def get_names(refs):
+    return [ref.name for ref in refs]
+
+
+def test_root_lists_letters(library):
+    refs = library.browse("funkwhale:directory:/albums")
+    assert get_names(refs) == backend.SHARDS
+
+
+def test_letters_share_one_listing(library, catalogue):
+    assert get_names(library.browse("funkwhale:directory:/albums/A")) == ["Abba"]
+    assert get_names(library.browse("funkwhale:directory:/albums/B")) == ["bach"]
+    assert get_names(library.browse("funkwhale:directory:/albums/E")) == ["Éclat"]
+    assert get_names(library.browse("funkwhale:directory:/albums/#")) == ["2001"]
+    assert get_names(library.browse("funkwhale:directory:/albums/Z")) == []
+    assert catalogue.listings == 1
+    assert get_names(library.browse("funkwhale:directory:/artists/B")) == ["Bach"]
+    assert catalogue.listings == 2
+
+
+def test_failed_listing_is_not_kept(library, catalogue):
+    catalogue.failing = True
+    assert library.browse("funkwhale:directory:/albums/A") == []
+    catalogue.failing = False
+    assert get_names(library.browse("funkwhale:directory:/albums/A")) == ["Abba"]
+    assert catalogue.listings == 2
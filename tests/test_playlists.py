@@ -0,0 +1,221 @@
+import random
+
+import pytest
+
+from mopidy import models
+
+from mopidy_funkwhale import backend, cache
+
+
+def apply_operations(tracks, operations):
+    tracks = list(tracks)
+    for operation in operations:
+        if operation[0] == "remove":
+            tracks.pop(operation[1])
+        elif operation[0] == "add":
+            tracks.extend(operation[1])
+        elif operation[0] == "move":
+            tracks.insert(operation[2], tracks.pop(operation[1]))
+        elif operation[0] == "clear":
+            tracks = []
+    return tracks
+
+
+@pytest.mark.parametrize(
+    "old, new",
+    [
+        ([], []),
+        ([], ["a", "b"]),
+        (["a", "b"], []),
+        (["a", "b", "c"], ["a", "b", "c"]),
+        (["a", "b", "c"], ["c", "b", "a"]),
+        (["a", "b", "c", "d"], ["b", "c", "d", "a"]),
+        (["a", "b", "c"], ["a", "x", "c", "y"]),
+        (["a", "a", "b"], ["b", "a", "a"]),
+        (["a", "b", "a", "b"], ["b", "a"]),
+        (["a", "b"], ["a", "b", "a", "b", "a"]),
+        (["a", "b", "a"], ["a", "a", "b", "b"]),
+    ],
+)
+def test_diff_playlist(old, new):
+    assert apply_operations(old, backend.diff_playlist(old, new)) == new
+
+
+def test_diff_playlist_random_with_duplicates():
+    rng = random.Random(42)
+    for _ in range(500):
+        old = [rng.choice("abcdef") for _ in range(rng.randint(0, 12))]
+        new = [rng.choice("abcdefgh") for _ in range(rng.randint(0, 12))]
+        assert apply_operations(old, backend.diff_playlist(old, new)) == new
+
+
+def test_diff_playlist_unchanged_has_no_operations():
+    assert backend.diff_playlist(["a", "b", "a"], ["a", "b", "a"]) == []
+
+
+def test_diff_playlist_moves_only_tracks_out_of_order():
+    operations = backend.diff_playlist(["a", "b", "c", "d", "e"], ["e", "a", "b", "c", "d"])
+    assert operations == [("move", 4, 0)]
+
+
+def test_diff_playlist_removes_last_first():
+    operations = backend.diff_playlist(["a", "b", "c", "d"], ["b", "d"])
+    assert operations == [("remove", 2), ("remove", 0)]
+
+
+def test_diff_playlist_adds_once():
+    operations = backend.diff_playlist(["a"], ["x", "a", "y"])
+    assert [o for o in operations if o[0] == "add"] == [("add", ["x", "y"])]
+
+
+@pytest.mark.parametrize(
+    "values, expected",
+    [
+        ([], set()),
+        ([3], {3}),
+        ([0, 1, 2, 3], {0, 1, 2, 3}),
+        ([3, 2, 1, 0], {0}),
+        ([4, 0, 1, 2, 3], {0, 1, 2, 3}),
+        ([1, 5, 2, 6, 3, 4], {1, 2, 3, 4}),
+    ],
+)
+def test_longest_increasing_subsequence(values, expected):
+    assert backend.longest_increasing_subsequence(values) == expected
+
+
+def test_longest_increasing_subsequence_is_increasing_in_order():
+    rng = random.Random(1)
+    for _ in range(200):
+        values = rng.sample(range(50), rng.randint(1, 50))
+        result = backend.longest_increasing_subsequence(values)
+        kept = [value for value in values if value in result]
+        assert kept == sorted(kept)
+        # no longer increasing subsequence exists
+        longest = [1] * len(values)
+        for i in range(len(values)):
+            for j in range(i):
+                if values[j] < values[i]:
+                    longest[i] = max(longest[i], longest[j] + 1)
+        assert len(result) == max(longest)
+
+
+class FakeClient:
+    """
+    One playlist held in memory, changed by the client calls the provider
+    makes, which drop the cached answer like the real client does.
+    """
+
+    def __init__(self, tracks, track_json):
+        self.track_json = track_json
+        self.name = "Playlist"
+        self.tracks = list(tracks)
+        self.version = 0
+        self.cached = None
+
+    def change(self, tracks):
+        self.tracks = list(tracks)
+        self.version += 1
+        self.cached = None
+
+    def get_playlists(self, id=None, fresh=False):
+        if self.cached is None or fresh:
+            self.cached = {
+                "id": id,
+                "name": self.name,
+                "modification_date": f"2020-01-01T00:00:{self.version:02d}Z",
+            }
+        return self.cached
+
+    def get_playlists_tracks(self, id):
+        return [{"track": self.track_json(track)} for track in self.tracks]
+
+    def update_playlist(self, id, name):
+        self.name = name
+        self.change(self.tracks)
+        return {"id": id, "name": name}
+
+    def clear_playlist(self, id):
+        self.change([])
+        return True
+
+    def add_tracks_playlist(self, id, tracks):
+        self.change(self.tracks + [int(track) for track in tracks])
+        return True
+
+    def remove_playlist_track(self, id, index):
+        self.change(self.tracks[:index] + self.tracks[index + 1:])
+        return True
+
+    def move_playlist_track(self, id, from_index, to_index):
+        tracks = list(self.tracks)
+        tracks.insert(to_index, tracks.pop(from_index))
+        self.change(tracks)
+        return True
+
+
+class FakeBackend:
+    def __init__(self, client):
+        self.client = client
+        self.model_cache = cache.ModelCache(maxsize=100)
+
+
+@pytest.fixture
+def get_provider(track_json):
+    def get_provider(tracks):
+        client = FakeClient(tracks, track_json)
+        return client, backend.FunkwhalePlaylistProvider(FakeBackend(client))
+
+    return get_provider
+
+
+def get_tracks(playlist):
+    return [int(track.uri.rsplit(":", 1)[1]) for track in playlist.tracks]
+
+
+def test_save_applies_changes(get_provider):
+    client, provider = get_provider([1, 2, 3, 4])
+    playlist = provider.lookup("funkwhale:playlist:1")
+    tracks = playlist.tracks
+    saved = provider.save(playlist.replace(tracks=[tracks[3], tracks[0], tracks[2]]))
+    assert client.tracks == [4, 1, 3]
+    assert get_tracks(saved) == [4, 1, 3]
+
+
+def test_save_with_duplicates(get_provider):
+    client, provider = get_provider([1, 2, 1, 3])
+    playlist = provider.lookup("funkwhale:playlist:1")
+    tracks = playlist.tracks
+    saved = provider.save(playlist.replace(tracks=[tracks[1], tracks[0], tracks[2], tracks[0]]))
+    assert client.tracks == [2, 1, 1, 1]
+    assert get_tracks(saved) == [2, 1, 1, 1]
+
+
+def test_save_diffs_against_server_state(get_provider):
+    client, provider = get_provider([9, 18, 7, 16])
+    playlist = provider.lookup("funkwhale:playlist:1")
+    # changed elsewhere since it was looked up, the cached answer is outdated
+    client.tracks = [20, 9, 18, 7, 16]
+    client.version += 1
+    saved = provider.save(playlist.replace(tracks=playlist.tracks[:-1]))
+    assert client.tracks == [9, 18, 7]
+    assert get_tracks(saved) == [9, 18, 7]
+
+
+def test_save_leaves_other_server_tracks_out(get_provider):
+    client, provider = get_provider([1, 2])
+    playlist = provider.lookup("funkwhale:playlist:1")
+    other = models.Track(uri="funkwhale:track:5@other", name="Other")
+    saved = provider.save(playlist.replace(tracks=list(playlist.tracks) + [other]))
+    assert client.tracks == [1, 2]
+    assert [track.uri for track in saved.tracks] == [
+        "funkwhale:track:1",
+        "funkwhale:track:2",
+    ]
+
+
+def test_save_rewrites_after_many_operations(get_provider):
+    client, provider = get_provider(list(range(1, 41)))
+    playlist = provider.lookup("funkwhale:playlist:1")
+    saved = provider.save(playlist.replace(tracks=list(reversed(playlist.tracks))))
+    assert client.tracks == list(range(40, 0, -1))
+    assert get_tracks(saved) == list(range(40, 0, -1))
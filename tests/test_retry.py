@@ -0,0 +1,197 @@
+import pytest
+import requests
+
+from mopidy_funkwhale import metrics, retry
+
+
+class Response:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+class Server:
+    """Answer with each of ``answers`` in turn, an exception class is raised."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.requests = 0
+
+    def send(self):
+        self.requests += 1
+        answer = self.answers.pop(0) if len(self.answers) > 1 else self.answers[0]
+        if isinstance(answer, type):
+            raise answer("failed")
+        return Response(answer) if isinstance(answer, int) else answer
+
+
+@pytest.fixture(autouse=True)
+def sleeps(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(retry.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_success_is_not_retried():
+    server = Server(200)
+    assert retry.Retry().call("GET", "tracks/{id}", server.send).status_code == 200
+    assert server.requests == 1
+
+
+@pytest.mark.parametrize("failure", [500, 503, requests.ConnectionError, requests.Timeout])
+def test_failures_are_retried(failure):
+    server = Server(failure, failure, 200)
+    m = metrics.Metrics()
+    response = retry.Retry(retries=2, metrics=m).call("GET", "tracks/{id}", server.send)
+    assert response.status_code == 200
+    assert server.requests == 3
+    assert m.get("http_retries_total", endpoint="tracks/{id}", method="GET") == 2
+
+
+def test_gives_up_after_retries(sleeps):
+    server = Server(503)
+    response = retry.Retry(retries=2).call("GET", "tracks/{id}", server.send)
+    assert response.status_code == 503
+    assert server.requests == 3
+    assert len(sleeps) == 2
+
+
+def test_raises_after_retries():
+    server = Server(requests.ConnectionError)
+    with pytest.raises(requests.ConnectionError):
+        retry.Retry(retries=1).call("GET", "tracks/{id}", server.send)
+    assert server.requests == 2
+
+
+def test_client_errors_are_not_retried():
+    server = Server(404)
+    assert retry.Retry().call("GET", "tracks/{id}", server.send).status_code == 404
+    assert server.requests == 1
+
+
+@pytest.mark.parametrize("failure", [503, requests.ConnectionError])
+def test_non_idempotent_requests_are_not_retried(failure):
+    server = Server(failure, 200)
+    try:
+        retry.Retry(retries=2).call("POST", "playlists/{id}/add", server.send)
+    except requests.ConnectionError:
+        pass
+    assert server.requests == 1
+
+
+def test_too_many_requests_waits_retry_after(sleeps):
+    server = Server(Response(429, {"Retry-After": "2"}), 200)
+    response = retry.Retry().call("POST", "playlists/{id}/add", server.send)
+    assert response.status_code == 200
+    assert sleeps == [2.0]
+
+
+def test_too_many_requests_wait_is_capped(sleeps):
+    server = Server(Response(429, {"Retry-After": "3"}))
+    response = retry.Retry(retries=5).call("GET", "tracks/{id}", server.send)
+    assert response.status_code == 429
+    assert sum(sleeps) <= retry.MAX_RETRY_AFTER
+    assert server.requests == 2
+
+
+def test_too_many_requests_long_wait_is_not_waited(sleeps):
+    server = Server(Response(429, {"Retry-After": "60"}))
+    response = retry.Retry().call("GET", "tracks/{id}", server.send)
+    assert response.status_code == 429
+    assert server.requests == 1
+    assert sleeps == []
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({}, None),
+        ({"Retry-After": "1.5"}, 1.5),
+        ({"Retry-After": "-1"}, 0.0),
+        ({"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}, None),
+    ],
+)
+def test_get_retry_after(headers, expected):
+    assert retry.get_retry_after(Response(429, headers)) == expected
+
+
+def test_get_backoff_is_bounded():
+    for attempt in range(20):
+        assert 0 <= retry.get_backoff(attempt) <= retry.MAX_BACKOFF
+
+
+def test_breaker_opens_after_threshold():
+    breaker = retry.CircuitBreaker(threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure()
+        breaker.check()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    with pytest.raises(retry.CircuitOpenError):
+        breaker.check()
+
+
+def test_breaker_success_resets_failures():
+    breaker = retry.CircuitBreaker(threshold=2, reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == breaker.CLOSED
+
+
+def test_breaker_probe_closes_on_success():
+    breaker = retry.CircuitBreaker(threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    breaker.check()
+    assert breaker.state == breaker.HALF_OPEN
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED
+
+
+def test_breaker_probe_reopens_on_failure():
+    breaker = retry.CircuitBreaker(threshold=5, reset_timeout=0)
+    for _ in range(5):
+        breaker.record_failure()
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+
+
+def test_request_counts_as_one_failure():
+    server = Server(503)
+    r = retry.Retry(retries=2, threshold=2, reset_timeout=60)
+    r.call("GET", "tracks/{id}", server.send)
+    assert r.get_breaker("tracks/{id}").failures == 1
+    assert r.get_breaker("tracks/{id}").state == retry.CircuitBreaker.CLOSED
+    r.call("GET", "tracks/{id}", server.send)
+    assert r.get_breaker("tracks/{id}").state == retry.CircuitBreaker.OPEN
+    assert server.requests == 6
+
+
+def test_open_circuit_does_not_send():
+    server = Server(requests.ConnectionError)
+    r = retry.Retry(retries=0, threshold=1, reset_timeout=60)
+    with pytest.raises(requests.ConnectionError):
+        r.call("GET", "tracks/{id}", server.send)
+    with pytest.raises(retry.CircuitOpenError):
+        r.call("GET", "tracks/{id}", server.send)
+    assert server.requests == 1
+
+
+def test_breakers_are_per_endpoint():
+    r = retry.Retry(retries=0, threshold=1, reset_timeout=60)
+    r.call("GET", "search", Server(503).send)
+    with pytest.raises(retry.CircuitOpenError):
+        r.call("GET", "search", Server(200).send)
+    assert r.call("GET", "tracks/{id}", Server(200).send).status_code == 200
+
+
+def test_probe_is_sent_once():
+    server = Server(503)
+    r = retry.Retry(retries=2, threshold=1, reset_timeout=0)
+    r.call("GET", "tracks/{id}", server.send)
+    assert server.requests == 3
+    # the circuit is open, the next request probes it with a single attempt
+    r.call("GET", "tracks/{id}", server.send)
+    assert server.requests == 4
+    assert r.get_breaker("tracks/{id}").state == retry.CircuitBreaker.OPEN
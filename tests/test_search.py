@@ -0,0 +1,141 @@
+import pytest
+
+from mopidy_funkwhale import search
+
+
+ARTISTS = [
+    {"id": 1, "name": "Björk"},
+    {"id": 2, "name": "Boards of Canada"},
+]
+ALBUMS = [
+    {"id": 10, "title": "Homogenic", "artist": ARTISTS[0], "release_date": "1997-09-22"},
+    {"id": 20, "title": "Geogaddi", "artist": ARTISTS[1], "release_date": "2002-02-18"},
+]
+TRACKS = [
+    {"id": 100, "title": "Jóga", "artist": ARTISTS[0], "album": ALBUMS[0], "tags": ["electronic"]},
+    {"id": 101, "title": "Bachelorette", "artist": ARTISTS[0], "album": ALBUMS[0], "tags": []},
+    {"id": 200, "title": "Music Is Math", "artist": ARTISTS[1], "album": ALBUMS[1], "tags": ["idm"]},
+    # a guest on someone else's album
+    {"id": 201, "title": "Alpha and Omega", "artist": ARTISTS[0], "album": ALBUMS[1], "tags": []},
+]
+
+
+class LibraryIndex:
+    def iter_artists(self):
+        return iter(ARTISTS)
+
+    def iter_albums(self):
+        return iter(ALBUMS)
+
+    def iter_tracks(self):
+        return iter(TRACKS)
+
+
+@pytest.fixture
+def index():
+    index = search.SearchIndex()
+    index.build(LibraryIndex())
+    return index
+
+
+def test_not_ready_before_build():
+    assert not search.SearchIndex().ready
+
+
+def test_ready_after_build(index):
+    assert index.ready
+
+
+def test_normalize():
+    assert search.normalize(" Jóga ") == "joga"
+    assert search.tokenize("Boards of Canada!") == ["boards", "of", "canada"]
+
+
+def test_any_field(index):
+    results = index.search({"any": ["bjork"]})
+    assert results["artists"] == [1]
+    assert results["albums"] == [10]
+    assert results["tracks"] == [100, 101, 201]
+
+
+def test_prefix(index):
+    assert index.search({"track_name": ["bach"]})["tracks"] == [101]
+
+
+def test_accents_are_ignored(index):
+    assert index.search({"track_name": ["joga"]})["tracks"] == [100]
+    assert index.search({"track_name": ["Jóga"]})["tracks"] == [100]
+
+
+def test_every_word_must_match(index):
+    assert index.search({"track_name": ["music math"]})["tracks"] == [200]
+    assert index.search({"track_name": ["music joga"]})["tracks"] == []
+
+
+def test_fields_are_combined(index):
+    results = index.search({"artist": ["bjork"], "album": ["geogaddi"]})
+    assert results["tracks"] == [201]
+    assert results["albums"] == []
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ({"album": ["homogenic"]}, [100, 101]),
+        ({"albumartist": ["boards"]}, [200, 201]),
+        ({"date": ["1997"]}, [100, 101]),
+        ({"genre": ["idm"]}, [200]),
+    ],
+)
+def test_track_fields(index, query, expected):
+    assert index.search(query)["tracks"] == expected
+
+
+def test_kinds_without_the_field_match_nothing(index):
+    results = index.search({"track_name": ["joga"]})
+    assert results["artists"] == []
+    assert results["albums"] == []
+
+
+def test_exact(index):
+    assert index.search({"artist": ["Boards"]}, exact=True)["artists"] == []
+    assert index.search({"artist": ["boards of canada"]}, exact=True)["artists"] == [2]
+    assert index.search({"track_name": ["joga"]}, exact=True)["tracks"] == [100]
+
+
+def test_uris_filter_by_parent(index):
+    results = index.search({"any": ["bjork"]}, uris=["funkwhale:album:20"])
+    assert results["tracks"] == [201]
+    assert results["albums"] == []
+    results = index.search({"any": ["bjork"]}, uris=["funkwhale:artist:1"])
+    assert results["tracks"] == [100, 101, 201]
+    assert results["albums"] == [10]
+
+
+def test_uris_filter_by_item(index):
+    results = index.search({"any": ["bjork"]}, uris=["funkwhale:track:101"])
+    assert results["tracks"] == [101]
+
+
+def test_uris_root_is_everything(index):
+    results = index.search({"any": ["bjork"]}, uris=["funkwhale:directory:/"])
+    assert results["tracks"] == [100, 101, 201]
+
+
+def test_limit(index):
+    assert index.search({"any": ["bjork"]}, limit=2)["tracks"] == [100, 101]
+
+
+def test_empty_value_matches_nothing(index):
+    assert index.search({"any": ["!"]})["tracks"] == []
+
+
+def test_stopped_build_keeps_previous_content(index):
+    index.build(LibraryIndex(), stopped=lambda: True)
+    assert index.search({"any": ["bjork"]})["artists"] == [1]
+
+
+def test_stopped_first_build_is_not_ready():
+    index = search.SearchIndex()
+    index.build(LibraryIndex(), stopped=lambda: True)
+    assert not index.ready
@@ -0,0 +1,24 @@
+from mopidy_funkwhale import backend, streams
+
+
+def test_policy_key():
+    assert streams.StreamPolicy().key == "any-0"
+    assert streams.StreamPolicy("MP3", 192).key == "mp3-192"
+    assert streams.StreamPolicy("../ogg", None).key == "___ogg-0"
+
+
+def test_audio_key_depends_on_policy():
+    default = streams.StreamPolicy()
+    assert backend.get_audio_key("funkwhale:track:12", default) == "12.any-0"
+    assert backend.get_audio_key("funkwhale:track:12@other", default) == "12@other.any-0"
+    assert backend.get_audio_key(
+        "funkwhale:track:12", streams.StreamPolicy("opus", 96)
+    ) != backend.get_audio_key("funkwhale:track:12", default)
+
+
+def test_policy_from_overrides():
+    config = {
+        "funkwhale": {"stream_format": "flac", "stream_overrides": ["bluetooth=mp3/128"]},
+        "audio": {"output": "autoaudiosink bluetooth"},
+    }
+    assert streams.StreamPolicy.from_config(config).key == "mp3-128"
@@ -0,0 +1,223 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from mopidy_funkwhale import index as index_module
+from mopidy_funkwhale import sync
+
+
+class Client:
+    """
+    Serve ``items``, a dict of endpoint to items newest first, in pages,
+    favorite tracks under "favorites". Endpoints in ``failing`` raise a
+    connection error, ``on_request`` is called before each answer.
+    """
+
+    page_size = 2
+
+    def __init__(self, items):
+        self.items = items
+        self.failing = set()
+        self.requests = []
+        self.on_request = None
+
+    def get_page(self, path, params=None):
+        endpoint, _, page = path.partition("?page=")
+        if (params or {}).get("favorites"):
+            endpoint = "favorites"
+        page = int(page or 1)
+        self.requests.append((endpoint, page))
+        if self.on_request is not None:
+            self.on_request(endpoint, page)
+        if endpoint in self.failing:
+            raise requests.ConnectionError("failed")
+        items = self.items.get(endpoint, [])
+        start = (page - 1) * self.page_size
+        end = start + self.page_size
+        return {
+            "results": items[start:end],
+            "next": f"{endpoint}?page={page + 1}" if end < len(items) else None,
+        }
+
+
+class Playlists:
+    def __init__(self):
+        self.loaded = []
+
+    def load(self, json, get_tracks=None):
+        self.loaded.append((json["id"], get_tracks(json["id"])))
+
+
+class Backend:
+    def __init__(self, client, index):
+        self.client = client
+        self.index = index
+        self.search_index = None
+        self.playlists = Playlists()
+
+
+def dated(items, start=0):
+    # newest first, as asked with ordering=-creation_date
+    return [
+        dict(item, creation_date=f"2020-01-01T00:00:{start + len(items) - n:02d}Z")
+        for n, item in enumerate(items)
+    ]
+
+
+def get_ids(items):
+    return [item["id"] for item in items]
+
+
+@pytest.fixture
+def catalogue(artist_json, album_json, track_json):
+    return {
+        "artists/": dated([artist_json(id) for id in (2, 1)]),
+        "albums/": dated([album_json(id, artist=1) for id in (3, 2, 1)]),
+        "tracks/": dated([track_json(id) for id in (4, 3, 2, 1)]),
+        "favorites": [track_json(2)],
+        "playlists/": [{"id": 1, "name": "Playlist"}],
+        "playlists/1/tracks": [{"track": track_json(1)}],
+    }
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = index_module.LibraryIndex(str(tmp_path / "library.sqlite3"))
+    yield index
+    index.close()
+
+
+@pytest.fixture
+def client(catalogue):
+    return Client(catalogue)
+
+
+@pytest.fixture
+def worker(client, index):
+    return sync.LibrarySync(Backend(client, index))
+
+
+def test_failed_sync_leaves_index_not_ready(client, index, worker):
+    client.failing.add("albums/")
+    worker.sync()
+    assert not index.ready
+    assert list(index.iter_albums()) == []
+    assert index.get_meta("full_sync_at") is None
+
+
+def test_every_page_fails(client, index, worker):
+    client.failing.update(["artists/", "albums/", "tracks/"])
+    worker.sync()
+    assert not index.ready
+
+
+def test_sync_fills_index(index, worker):
+    worker.sync()
+    assert index.ready
+    assert [album["id"] for album in index.iter_albums()] == [1, 2, 3]
+    assert [track["id"] for track in index.iter_tracks()] == [1, 2, 3, 4]
+
+
+def test_stop_waits_for_the_thread(client, index, worker):
+    started = threading.Event()
+    get_page = client.get_page
+
+    def slow_get_page(path, params=None):
+        started.set()
+        time.sleep(0.05)
+        return get_page(path, params)
+
+    client.get_page = slow_get_page
+    worker.interval = 3600
+    worker.start()
+    started.wait(5)
+    worker.stop(timeout=5)
+    assert not worker.is_alive()
+    # closing the index is safe once the thread is gone
+    index.close()
+
+
+def test_delta_sync_stops_at_known_items(client, index, worker, catalogue, album_json):
+    worker.sync()
+    catalogue["albums/"] = dated([album_json(5), album_json(4)], start=50) + catalogue["albums/"]
+    client.requests.clear()
+    assert worker.sync_catalogue(index) == 2
+    assert get_ids(index.iter_albums()) == [1, 2, 3, 4, 5]
+    # the first page already reaches the albums of the previous sync
+    assert client.requests.count(("albums/", 2)) == 1
+    assert ("albums/", 3) not in client.requests
+    assert client.requests.count(("tracks/", 1)) == 1
+    assert ("tracks/", 2) not in client.requests
+
+
+def test_delta_sync_keeps_deleted_items(client, index, worker, catalogue):
+    worker.sync()
+    del catalogue["albums/"][0]
+    worker.sync()
+    assert get_ids(index.iter_albums()) == [1, 2, 3]
+
+
+def test_full_sync_prunes_deleted_items(client, index, worker, catalogue):
+    worker.sync()
+    del catalogue["albums/"][0]
+    index.set_meta("full_sync_at", "0")
+    worker.sync()
+    assert get_ids(index.iter_albums()) == [1, 2]
+
+
+def test_stopped_sync_does_not_skip_or_prune(client, index, worker, catalogue, album_json):
+    worker.sync()
+    index.set_meta("full_sync_at", "0")
+    newest = index.get_meta("newest_albums")
+    catalogue["albums/"] = dated([album_json(5), album_json(4)], start=50) + catalogue["albums/"]
+
+    def stop(endpoint, page):
+        if endpoint == "albums/" and page == 2:
+            worker.stop()
+
+    client.on_request = stop
+    worker.sync()
+    # the unseen rows are neither pruned nor skipped by the next sync
+    assert get_ids(index.iter_albums()) == [1, 2, 3, 4, 5]
+    assert index.get_meta("newest_albums") == newest
+    assert index.get_meta("full_sync_at") == "0"
+
+
+def test_failed_table_does_not_advance(client, index, worker, catalogue, album_json):
+    worker.sync()
+    newest = index.get_meta("newest_albums")
+    catalogue["albums/"] = dated([album_json(4)], start=50) + catalogue["albums/"]
+    client.failing.add("albums/")
+    worker.sync()
+    assert index.get_meta("newest_albums") == newest
+    client.failing.clear()
+    worker.sync()
+    assert get_ids(index.iter_albums()) == [1, 2, 3, 4]
+
+
+def test_favorites(index, worker):
+    worker.sync()
+    assert get_ids(index.get_favorites()) == [2]
+
+
+def test_failed_favorites_are_kept(client, index, worker, catalogue):
+    worker.sync()
+    catalogue["favorites"] = []
+    client.failing.add("favorites")
+    worker.sync()
+    assert get_ids(index.get_favorites()) == [2]
+
+
+def test_playlists(worker):
+    worker.sync()
+    loaded = worker.backend.playlists.loaded
+    assert [(id, [item["track"]["id"] for item in tracks]) for id, tracks in loaded] == [(1, [1])]
+
+
+def test_requests_are_sequential(client, worker):
+    worker.sync()
+    # one page after the other, in order
+    albums = [page for endpoint, page in client.requests if endpoint == "albums/"]
+    assert albums == [1, 2]
@@ -0,0 +1,80 @@
+import pytest
+
+from mopidy_funkwhale import servers, uri
+
+
+@pytest.mark.parametrize(
+    "p_uri, id, server",
+    [
+        ("funkwhale:track:12", "12", None),
+        ("funkwhale:track:12@other", "12", "other"),
+        ("funkwhale:album:3@other", "3", "other"),
+        ("funkwhale:artist:7", "7", None),
+        ("funkwhale:playlist:5", "5", None),
+    ],
+)
+def test_get_id_and_server(p_uri, id, server):
+    assert uri.get_id(p_uri) == id
+    assert uri.get_server(p_uri) == server
+
+
+def test_get_uri():
+    assert uri.get_track_uri(12) == "funkwhale:track:12"
+    assert uri.get_track_uri(12, "other") == "funkwhale:track:12@other"
+    assert uri.get_album_uri(3, None) == "funkwhale:album:3"
+    assert uri.get_artist_uri(7, "other") == "funkwhale:artist:7@other"
+
+
+def test_round_trip():
+    p_uri = uri.get_album_uri(3, "other")
+    assert uri.get_type(p_uri) == uri.ALBUM
+    assert uri.get_uri(uri.get_type(p_uri), uri.get_id(p_uri), uri.get_server(p_uri)) == p_uri
+
+
+def test_paths():
+    p_uri = uri.get_path_uri("/albums/A")
+    assert uri.get_type(p_uri) == uri.PATH
+    assert uri.get_path(p_uri) == "/albums/A"
+    assert uri.get_server(p_uri) is None
+
+
+@pytest.fixture
+def config():
+    return {
+        "funkwhale": {
+            "url": "http://main.test",
+            "client_id": "id",
+            "client_secret": "secret",
+            "servers": [
+                "other http://other.test/ other-id other-secret",
+                "public http://public.test",
+                "bad:name http://bad.test",
+                "incomplete http://incomplete.test id",
+                "other http://duplicate.test",
+            ],
+        },
+    }
+
+
+def test_parse_servers(config):
+    assert servers.parse_servers(config) == [
+        ("other", "http://other.test", "other-id", "other-secret"),
+        ("public", "http://public.test", None, None),
+        ("other", "http://duplicate.test", None, None),
+    ]
+
+
+def test_from_config(config):
+    by_name = servers.from_config(config, None)
+    assert list(by_name) == [None, "other", "public"]
+    assert by_name[None].url == "http://main.test"
+    assert by_name["other"].url == "http://other.test"
+    assert by_name["other"].config["funkwhale"]["client_id"] == "other-id"
+    assert by_name["public"].config["funkwhale"]["server"] == "public"
+    assert by_name["public"].model_cache.server == "public"
+
+
+def test_get_server_config(config):
+    assert servers.get_server_config(config) is config
+    assert servers.get_server_config(config, "public")["funkwhale"]["url"] == "http://public.test"
+    assert servers.get_server_config(config, "missing") is None